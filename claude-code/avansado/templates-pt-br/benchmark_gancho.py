@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+[TEMPLATE] [PORTUGUES-BR]
+Benchmark de partida a frio do gancho básico
+  importtime  roda o gancho com "python -X importtime" e mostra as importações mais caras
+  replay      reenvia eventos gravados ao gancho, um processo por evento, e mede o tempo total
+
+Exemplos:
+  python benchmark_gancho.py importtime
+  python benchmark_gancho.py replay --eventos .claude/logs/eventos_2025-08-28.jsonl
+  git show HEAD~1:./gancho-basico.py > /tmp/gancho-antigo.py
+  python benchmark_gancho.py replay --referencia /tmp/gancho-antigo.py
+"""
+
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+GANCHO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gancho-basico.py')
+
+EVENTO_EXEMPLO = {
+    'tool': 'Bash',
+    'input': {'command': 'ls -la'},
+    'purpose': 'benchmark'
+}
+
+def carregar_eventos(caminho: str, maximo: int) -> list:
+    """Lê entradas do gancho; linhas já registradas em log são convertidas de volta"""
+    if not caminho:
+        return [json.dumps(EVENTO_EXEMPLO).encode('utf-8')] * maximo
+
+    eventos = []
+    with open(caminho, 'rb') as arquivo:
+        for linha in arquivo:
+            try:
+                evento = json.loads(linha)
+            except ValueError:
+                continue
+            if 'dados' in evento:
+                # Linha de eventos_*.jsonl: reconstrói o que o gancho recebeu
+                evento = {
+                    'tool': evento.get('ferramenta'),
+                    'input': evento['dados'].get('entrada', {}),
+                    'purpose': evento['dados'].get('proposito')
+                }
+            eventos.append(json.dumps(evento, ensure_ascii=False).encode('utf-8'))
+            if len(eventos) >= maximo:
+                break
+    return eventos
+
+def medir_importacoes(gancho: str, flags: list):
+    """Mostra o tempo total de importação e os módulos mais caros"""
+    with tempfile.TemporaryDirectory() as diretorio:
+        resultado = subprocess.run(
+            [sys.executable, '-X', 'importtime', *flags, gancho],
+            input=json.dumps(EVENTO_EXEMPLO).encode('utf-8'),
+            capture_output=True,
+            cwd=diretorio
+        )
+
+    medidas = []
+    for linha in resultado.stderr.decode('utf-8', 'replace').splitlines():
+        if not linha.startswith('import time:') or 'cumulative' in linha:
+            continue
+        proprio, acumulado, modulo = linha[len('import time:'):].split('|')
+        # Recuo de um espaço = importação de nível superior; mais espaços = aninhada
+        medidas.append((int(acumulado), int(proprio), modulo.rstrip()[1:]))
+
+    # Só os módulos de nível superior somam o total sem contar duas vezes
+    total = sum(acumulado for acumulado, _, modulo in medidas if not modulo.startswith(' '))
+    print(f"{gancho} {' '.join(flags)}")
+    print(f"  importações: {total / 1000:.1f} ms em {len(medidas)} módulos")
+    for acumulado, proprio, modulo in sorted(medidas, reverse=True)[:10]:
+        print(f"  {acumulado / 1000:7.2f} ms  (próprio {proprio / 1000:5.2f})  {modulo.strip()}")
+
+def _aguardar_socket(diretorio: str, limite: float = 5.0):
+    caminho = os.path.join(diretorio, '.claude', 'gancho.sock')
+    prazo = time.monotonic() + limite
+    while not os.path.exists(caminho) and time.monotonic() < prazo:
+        time.sleep(0.01)
+
+def _encerrar_daemon(diretorio: str):
+    """Encerra o daemon (ou o drenador do spool) iniciado no diretório temporário"""
+    saida = subprocess.run(['ps', '-eo', 'pid,args'], capture_output=True, text=True).stdout
+    encerrados = []
+    for linha in saida.splitlines():
+        pid, _, argumentos = linha.strip().partition(' ')
+        if '--servidor' not in argumentos and '--drenar' not in argumentos:
+            continue
+        try:
+            if os.readlink(f'/proc/{pid}/cwd') == os.path.realpath(diretorio):
+                os.kill(int(pid), signal.SIGTERM)
+                encerrados.append(pid)
+        except OSError:
+            pass
+
+    # Espera o daemon apagar o próprio socket antes de remover o diretório
+    prazo = time.monotonic() + 5.0
+    while any(os.path.exists(f'/proc/{pid}') for pid in encerrados) and time.monotonic() < prazo:
+        time.sleep(0.01)
+
+def reproduzir(rotulo: str, comando: list, eventos: list, daemon: bool) -> list:
+    """Roda um processo do gancho por evento e devolve os tempos em segundos"""
+    tempos = []
+    with tempfile.TemporaryDirectory() as diretorio:
+        try:
+            if daemon:
+                # O primeiro evento sobe o daemon; a medição começa com ele pronto
+                subprocess.run(comando, input=eventos[0], cwd=diretorio)
+                if '--daemon' in comando:
+                    _aguardar_socket(diretorio)
+                else:
+                    time.sleep(0.2)
+            for entrada in eventos:
+                inicio = time.perf_counter()
+                subprocess.run(comando, input=entrada, cwd=diretorio,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                tempos.append(time.perf_counter() - inicio)
+        finally:
+            if daemon:
+                _encerrar_daemon(diretorio)
+
+    ordenados = sorted(tempos)
+    p95 = ordenados[int(len(ordenados) * 0.95)]
+    print(f"  {rotulo:<28} mediana {statistics.median(tempos) * 1000:7.2f} ms   "
+          f"p95 {p95 * 1000:7.2f} ms   total {sum(tempos):6.2f} s")
+    return tempos
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de partida a frio do gancho')
+    subcomandos = parser.add_subparsers(dest='comando', required=True)
+
+    importacoes = subcomandos.add_parser('importtime')
+    importacoes.add_argument('--gancho', default=GANCHO)
+
+    replay = subcomandos.add_parser('replay')
+    replay.add_argument('--gancho', default=GANCHO)
+    replay.add_argument('--referencia', help='outra versão do gancho para comparar')
+    replay.add_argument('--eventos', help='JSONL com entradas gravadas (ou eventos_*.jsonl)')
+    replay.add_argument('--maximo', type=int, default=200, help='eventos reproduzidos')
+    args = parser.parse_args()
+
+    if args.comando == 'importtime':
+        medir_importacoes(args.gancho, [])
+        medir_importacoes(args.gancho, ['-S'])
+        return
+
+    eventos = carregar_eventos(args.eventos, args.maximo)
+    print(f"{len(eventos)} eventos reproduzidos, um processo por evento")
+    configuracoes = []
+    if args.referencia:
+        configuracoes.append(('referência', [sys.executable, args.referencia], False))
+    configuracoes += [
+        ('direto', [sys.executable, args.gancho], False),
+        ('direto -S', [sys.executable, '-S', args.gancho], False),
+        ('daemon -S', [sys.executable, '-S', args.gancho, '--daemon'], True),
+        ('spool -S', [sys.executable, '-S', args.gancho, '--spool'], True),
+        ('interpretador vazio -S', [sys.executable, '-S', '-c', 'pass'], False)
+    ]
+
+    medianas = {}
+    for rotulo, comando, daemon in configuracoes:
+        medianas[rotulo] = statistics.median(reproduzir(rotulo, comando, eventos, daemon))
+    base = medianas[configuracoes[0][0]]
+    for rotulo, mediana in medianas.items():
+        print(f"  {rotulo:<28} {mediana / base:6.2f}x da primeira configuração")
+
+if __name__ == "__main__":
+    main()
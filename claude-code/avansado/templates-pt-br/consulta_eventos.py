@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+[TEMPLATE] [PORTUGUES-BR]
+Consultas sobre os logs de eventos gravados pelo gancho básico
+Mantém um índice SQLite ao lado dos arquivos .claude/logs/eventos_*.jsonl,
+atualizado de forma incremental a partir do último byte lido de cada arquivo
+
+Exemplos:
+  python consulta_eventos.py contar --por ferramenta --desde 2025-08-25
+  python consulta_eventos.py listar --ferramenta Bash --limite 20
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+from rotacao_eventos import (DIRETORIO_LOGS, abrir_em, arquivos_por_dia, ler_linha_em,
+                             partes_do_dia, tamanho_descomprimido)
+
+NOME_INDICE = 'indice_eventos.sqlite'
+# Bytes lidos por vez ao indexar arquivos grandes
+TAMANHO_BLOCO = 1024 * 1024
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS arquivos (
+    nome TEXT PRIMARY KEY,
+    lido_ate INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS eventos (
+    timestamp TEXT NOT NULL,
+    tipo TEXT,
+    ferramenta TEXT,
+    arquivo TEXT NOT NULL,
+    posicao INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS eventos_timestamp ON eventos (timestamp);
+CREATE INDEX IF NOT EXISTS eventos_ferramenta ON eventos (ferramenta, timestamp);
+CREATE INDEX IF NOT EXISTS eventos_tipo ON eventos (tipo, timestamp);
+CREATE INDEX IF NOT EXISTS eventos_arquivo ON eventos (arquivo);
+"""
+
+# Colunas aceitas em agrupamentos (nomes nunca vêm direto do usuário para o SQL)
+AGRUPAMENTOS = {
+    'ferramenta': 'ferramenta',
+    'tipo': 'tipo',
+    'dia': 'substr(timestamp, 1, 10)'
+}
+
+class IndiceEventos:
+    """Índice incremental e consultas sobre os eventos do gancho"""
+
+    def __init__(self, diretorio_logs: str = DIRETORIO_LOGS):
+        self.diretorio_logs = diretorio_logs
+        self.conexao = sqlite3.connect(os.path.join(diretorio_logs, NOME_INDICE))
+        self.conexao.executescript(ESQUEMA)
+
+    def atualizar(self) -> int:
+        """Indexa só os bytes novos de cada arquivo; retorna eventos adicionados"""
+        lidos = dict(self.conexao.execute('SELECT nome, lido_ate FROM arquivos'))
+        novos = 0
+        # Índice usa sempre o nome ao vivo (eventos_X.jsonl), mesmo após a compressão
+        presentes = set()
+        for _, caminho in arquivos_por_dia(self.diretorio_logs):
+            nome = os.path.basename(caminho)
+            presentes.add(nome[:nome.index('.jsonl') + len('.jsonl')])
+
+        with self.conexao:
+            # Dias apagados pela retenção saem do índice
+            for nome in set(lidos) - presentes:
+                self.conexao.execute('DELETE FROM eventos WHERE arquivo = ?', (nome,))
+                self.conexao.execute('DELETE FROM arquivos WHERE nome = ?', (nome,))
+
+        for nome in sorted(presentes):
+            partes = partes_do_dia(self.diretorio_logs, nome)
+            if not partes:
+                continue
+            inicio = lidos.get(nome, 0)
+            # Tamanho lógico do dia: comprimido (pela tabela de quadros) + ao vivo
+            inicio_ultima, ultima = partes[-1]
+            if ultima.endswith('.jsonl'):
+                tamanho = inicio_ultima + os.path.getsize(ultima)
+            else:
+                tamanho = tamanho_descomprimido(ultima)
+            if tamanho == inicio:
+                # Dia sem mudanças: nem abre os arquivos
+                continue
+
+            with self.conexao:
+                if tamanho < inicio:
+                    # Arquivo truncado ou recriado: reindexa do zero
+                    self.conexao.execute('DELETE FROM eventos WHERE arquivo = ?', (nome,))
+                    inicio = 0
+                fim, quantidade = self._indexar_dia(partes, nome, inicio)
+                self.conexao.execute(
+                    'INSERT OR REPLACE INTO arquivos (nome, lido_ate) VALUES (?, ?)',
+                    (nome, fim)
+                )
+            novos += quantidade
+
+        return novos
+
+    def _indexar_dia(self, partes: list, nome: str, inicio: int) -> tuple:
+        """Indexa as partes do dia a partir da posição lógica inicio"""
+        posicao = inicio
+        quantidade = 0
+        for indice, (inicio_parte, caminho) in enumerate(partes):
+            proxima = partes[indice + 1][0] if indice + 1 < len(partes) else None
+            if proxima is not None and proxima <= inicio:
+                continue
+            # Uma linha sem '\n' no fim de uma parte anterior nunca se completa
+            posicao = max(posicao, inicio_parte)
+            posicao, lidos = self._indexar_arquivo(caminho, nome, inicio_parte, posicao)
+            quantidade += lidos
+        return posicao, quantidade
+
+    def _indexar_arquivo(self, caminho: str, nome: str, inicio_parte: int,
+                         inicio: int) -> tuple:
+        """Lê linhas completas a partir de inicio; retorna (posição final, eventos)"""
+        quantidade = 0
+        # Comprimido: a tabela de quadros pula direto para lido_ate
+        with abrir_em(caminho, inicio - inicio_parte) as arquivo:
+            posicao = inicio
+            resto = b''
+            while True:
+                bloco = arquivo.read(TAMANHO_BLOCO)
+                if not bloco:
+                    break
+                dados = resto + bloco
+                # Linha sem '\n' ainda está sendo escrita: fica para a próxima vez
+                corte = dados.rfind(b'\n') + 1
+                resto = dados[corte:]
+
+                linhas = []
+                for linha in dados[:corte].splitlines(keepends=True):
+                    registro = self._extrair(linha, nome, posicao)
+                    if registro is not None:
+                        linhas.append(registro)
+                    posicao += len(linha)
+                self.conexao.executemany(
+                    'INSERT INTO eventos (timestamp, tipo, ferramenta, arquivo, posicao) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    linhas
+                )
+                quantidade += len(linhas)
+        return posicao, quantidade
+
+    def _extrair(self, linha: bytes, nome: str, posicao: int):
+        try:
+            evento = json.loads(linha)
+        except ValueError:
+            return None
+        if not isinstance(evento, dict) or 'timestamp' not in evento:
+            return None
+        return (evento['timestamp'], evento.get('tipo'), evento.get('ferramenta'), nome, posicao)
+
+    def _filtros(self, tipo=None, ferramenta=None, desde=None, ate=None) -> tuple:
+        """Monta a cláusula WHERE; datas comparadas como texto ISO 8601"""
+        condicoes, valores = [], []
+        if tipo is not None:
+            condicoes.append('tipo = ?')
+            valores.append(tipo)
+        if ferramenta is not None:
+            condicoes.append('ferramenta = ?')
+            valores.append(ferramenta)
+        if desde is not None:
+            condicoes.append('timestamp >= ?')
+            valores.append(desde)
+        if ate is not None:
+            # "ate" só com a data inclui o dia inteiro
+            condicoes.append('timestamp < ?')
+            valores.append(ate + '\uffff' if len(ate) == 10 else ate)
+        clausula = (' WHERE ' + ' AND '.join(condicoes)) if condicoes else ''
+        return clausula, valores
+
+    def contar(self, por: str = 'ferramenta', limite: int = None, **filtros) -> list:
+        """Agrega eventos por ferramenta, tipo ou dia: [(chave, total), ...]"""
+        coluna = AGRUPAMENTOS[por]
+        clausula, valores = self._filtros(**filtros)
+        sql = (f'SELECT {coluna} AS chave, COUNT(*) AS total FROM eventos{clausula} '
+               f'GROUP BY chave ORDER BY total DESC, chave')
+        if limite is not None:
+            sql += ' LIMIT ?'
+            valores.append(limite)
+        return self.conexao.execute(sql, valores).fetchall()
+
+    def listar(self, limite: int = 100, **filtros):
+        """Devolve os eventos filtrados, lendo cada linha direto pela posição indexada"""
+        clausula, valores = self._filtros(**filtros)
+        consulta = self.conexao.execute(
+            f'SELECT arquivo, posicao FROM eventos{clausula} ORDER BY timestamp LIMIT ?',
+            valores + [limite]
+        )
+        for nome, posicao in consulta.fetchall():
+            # Funciona para o arquivo ao vivo e para o dia já comprimido
+            yield json.loads(ler_linha_em(self.diretorio_logs, nome, posicao))
+
+    def fechar(self):
+        self.conexao.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Consultas sobre os eventos do gancho')
+    parser.add_argument('--logs', default=DIRETORIO_LOGS, help='diretório dos eventos_*.jsonl')
+    subcomandos = parser.add_subparsers(dest='comando', required=True)
+
+    for nome in ('contar', 'listar'):
+        sub = subcomandos.add_parser(nome)
+        sub.add_argument('--tipo')
+        sub.add_argument('--ferramenta')
+        sub.add_argument('--desde', help='data/hora ISO inicial (inclusiva)')
+        sub.add_argument('--ate', help='data/hora ISO final')
+        sub.add_argument('--limite', type=int)
+        if nome == 'contar':
+            sub.add_argument('--por', choices=sorted(AGRUPAMENTOS), default='ferramenta')
+    subcomandos.add_parser('indexar')
+    args = parser.parse_args()
+
+    indice = IndiceEventos(args.logs)
+    novos = indice.atualizar()
+    if args.comando == 'indexar':
+        print(f"{novos} eventos novos indexados", file=sys.stderr)
+        return
+
+    filtros = {
+        'tipo': args.tipo,
+        'ferramenta': args.ferramenta,
+        'desde': args.desde,
+        'ate': args.ate
+    }
+    if args.comando == 'contar':
+        for chave, total in indice.contar(por=args.por, limite=args.limite, **filtros):
+            print(f"{total:8d}  {chave}")
+    else:
+        for evento in indice.listar(limite=args.limite or 100, **filtros):
+            print(json.dumps(evento, ensure_ascii=False))
+    indice.fechar()
+
+if __name__ == "__main__":
+    main()
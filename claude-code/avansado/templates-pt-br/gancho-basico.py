@@ -3,43 +3,301 @@
 [TEMPLATE] [PORTUGUES-BR]
 Gancho básico para logging de operações do Claude Code
 Adapte este template para suas necessidades específicas
+
+Modos de execução:
+  python gancho-basico.py            grava o evento direto no arquivo de log
+  python gancho-basico.py --daemon   envia o evento a um daemon residente
+                                     (iniciado automaticamente no primeiro uso)
+  python gancho-basico.py --spool    deposita o evento num buffer circular em
+                                     memória mapeada e retorna; um drenador
+                                     (--drenar, iniciado sob demanda) grava em lote
+  python gancho-basico.py --estado-spool   mostra os contadores do spool
+
+Este arquivo roda a cada chamada de ferramenta, então o início precisa ser
+rápido: só os, sys e time são importados no topo; o resto é importado dentro
+das funções que usam. Como o gancho só usa a stdlib, "python3 -S" economiza
+ainda a importação do site. Meça com benchmark_gancho.py.
 """
 
-import json
+import os
 import sys
-from datetime import datetime
-from pathlib import Path
+import time
+
+# Daemon residente: socket Unix e trava ficam no diretório .claude do projeto
+CAMINHO_SOCKET = '.claude/gancho.sock'
+CAMINHO_TRAVA = '.claude/gancho.lock'
+# Tempo máximo que o cliente espera pelo daemon antes de gravar direto
+TEMPO_LIMITE_CLIENTE = 0.5
+# Resposta do daemon a um evento recebido inteiro; sem ela o cliente grava direto
+CONFIRMACAO_DAEMON = b'+'
+# O daemon encerra sozinho após este tempo sem eventos (segundos)
+TEMPO_OCIOSO_DAEMON = 600
+# Escrita em lote no daemon: descarrega ao atingir o tamanho ou o intervalo
+TAMANHO_LOTE_DAEMON = 64 * 1024
+INTERVALO_LOTE_DAEMON = 1.0
+# Chama fsync após cada descarga (mais durável, mais lento)
+FSYNC_EVENTOS = False
+# Intervalo entre rotações (compressão e retenção) feitas pelo daemon, em segundos
+INTERVALO_ROTACAO = 3600
+# Spool: buffer circular compartilhado entre o gancho e o drenador
+CAMINHO_ANEL = '.claude/spool/eventos.anel'
+CAMINHO_TRAVA_DRENADOR = '.claude/spool/drenador.lock'
+CAPACIDADE_ANEL = 8 * 1024 * 1024
+# Spool cheio: 'novos' descarta o evento que chega, 'antigos' sobrescreve os mais velhos
+POLITICA_DESCARTE = 'novos'
+# Pausa do drenador quando o spool está vazio (segundos)
+INTERVALO_DRENAGEM = 0.5
+
+class AnelEventos:
+    """Spool em buffer circular mapeado em memória, compartilhado entre processos
+    
+    Cabeçalho de 64 bytes com inteiros de 8 bytes (little endian): mágico,
+    capacidade, cabeça e cauda (bytes escritos/consumidos desde a criação),
+    eventos aceitos e eventos descartados. Cada registro é
+    [tamanho: 4 bytes][instante em ns: 8 bytes][evento bruto].
+    """
+    
+    MAGICO = b'GANCHO01'
+    TAMANHO_CABECALHO = 64
+    CAMPOS = {'capacidade': 8, 'cabeca': 16, 'cauda': 24, 'aceitos': 32, 'descartados': 40}
+    
+    def __init__(self, caminho: str = CAMINHO_ANEL, capacidade: int = CAPACIDADE_ANEL):
+        import fcntl
+        import mmap
+        
+        self._fcntl = fcntl
+        try:
+            self._fd = os.open(caminho, os.O_RDWR | os.O_CREAT, 0o644)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            self._fd = os.open(caminho, os.O_RDWR | os.O_CREAT, 0o644)
+            
+        if os.fstat(self._fd).st_size < self.TAMANHO_CABECALHO:
+            self._travar()
+            try:
+                # Confere de novo com a trava: outro processo pode ter criado antes
+                if os.fstat(self._fd).st_size < self.TAMANHO_CABECALHO:
+                    os.ftruncate(self._fd, self.TAMANHO_CABECALHO + capacidade)
+                    os.pwrite(self._fd, self.MAGICO + capacidade.to_bytes(8, 'little'), 0)
+            finally:
+                self._destravar()
+                
+        self._mapa = mmap.mmap(self._fd, 0)
+        if self._mapa[:8] != self.MAGICO:
+            raise OSError(f"Spool inválido: {caminho}")
+        self.capacidade = self._ler('capacidade')
+    
+    def _travar(self):
+        self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+    
+    def _destravar(self):
+        self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+    
+    def _ler(self, campo: str) -> int:
+        inicio = self.CAMPOS[campo]
+        return int.from_bytes(self._mapa[inicio:inicio + 8], 'little')
+    
+    def _gravar(self, campo: str, valor: int):
+        inicio = self.CAMPOS[campo]
+        self._mapa[inicio:inicio + 8] = valor.to_bytes(8, 'little')
+    
+    def _copiar_para(self, posicao: int, dados: bytes):
+        """Escreve no anel dando a volta no fim da área de dados"""
+        inicio = posicao % self.capacidade
+        primeira = min(len(dados), self.capacidade - inicio)
+        base = self.TAMANHO_CABECALHO
+        self._mapa[base + inicio:base + inicio + primeira] = dados[:primeira]
+        if primeira < len(dados):
+            self._mapa[base:base + len(dados) - primeira] = dados[primeira:]
+    
+    def _copiar_de(self, posicao: int, tamanho: int) -> bytes:
+        inicio = posicao % self.capacidade
+        primeira = min(tamanho, self.capacidade - inicio)
+        base = self.TAMANHO_CABECALHO
+        dados = self._mapa[base + inicio:base + inicio + primeira]
+        if primeira < tamanho:
+            dados += self._mapa[base:base + tamanho - primeira]
+        return dados
+    
+    def publicar(self, instante_ns: int, evento: bytes, politica: str = POLITICA_DESCARTE) -> bool:
+        """Deposita um evento; devolve False se foi descartado por falta de espaço"""
+        registro = len(evento).to_bytes(4, 'little') + instante_ns.to_bytes(8, 'little') + evento
+        self._travar()
+        try:
+            cabeca, cauda = self._ler('cabeca'), self._ler('cauda')
+            livre = self.capacidade - (cabeca - cauda)
+            
+            if len(registro) > livre and politica == 'antigos' and len(registro) <= self.capacidade:
+                # Abre espaço descartando os registros mais antigos
+                while len(registro) > livre:
+                    tamanho = int.from_bytes(self._copiar_de(cauda, 4), 'little')
+                    cauda += 12 + tamanho
+                    livre += 12 + tamanho
+                    self._gravar('descartados', self._ler('descartados') + 1)
+                self._gravar('cauda', cauda)
+                
+            if len(registro) > livre:
+                self._gravar('descartados', self._ler('descartados') + 1)
+                return False
+                
+            self._copiar_para(cabeca, registro)
+            self._gravar('cabeca', cabeca + len(registro))
+            self._gravar('aceitos', self._ler('aceitos') + 1)
+            return True
+        finally:
+            self._destravar()
+    
+    def consumir(self) -> list:
+        """Retira todos os eventos pendentes: [(instante_ns, evento), ...]"""
+        self._travar()
+        try:
+            cabeca, cauda = self._ler('cabeca'), self._ler('cauda')
+            bloco = self._copiar_de(cauda, cabeca - cauda) if cabeca > cauda else b''
+            self._gravar('cauda', cabeca)
+        finally:
+            self._destravar()
+            
+        # A decodificação fica fora da trava para não segurar o gancho
+        registros = []
+        posicao = 0
+        while posicao < len(bloco):
+            tamanho = int.from_bytes(bloco[posicao:posicao + 4], 'little')
+            instante = int.from_bytes(bloco[posicao + 4:posicao + 12], 'little')
+            registros.append((instante, bloco[posicao + 12:posicao + 12 + tamanho]))
+            posicao += 12 + tamanho
+        return registros
+    
+    def estado(self) -> dict:
+        """Contadores do spool para monitoração"""
+        self._travar()
+        try:
+            valores = {campo: self._ler(campo) for campo in self.CAMPOS}
+        finally:
+            self._destravar()
+        valores['pendentes_bytes'] = valores['cabeca'] - valores['cauda']
+        return valores
+    
+    def fechar(self):
+        self._mapa.close()
+        os.close(self._fd)
+
+class EscritorEventos:
+    """Escritor dos arquivos eventos_AAAA-MM-DD.jsonl com arquivo aberto e escrita em lote"""
+    
+    def __init__(self, diretorio, tamanho_lote: int = 0, intervalo_lote: float = 1.0,
+                 fsync: bool = FSYNC_EVENTOS):
+        self.diretorio = str(diretorio)
+        # tamanho_lote=0 grava cada evento assim que chega
+        self.tamanho_lote = tamanho_lote
+        self.intervalo_lote = intervalo_lote
+        self.fsync = fsync
+        self._fd = None
+        self._dia_aberto = None
+        self._pendentes = []
+        self._bytes_pendentes = 0
+        self._dia_pendente = None
+        self._pendente_desde = 0.0
+    
+    def escrever(self, dia: str, linha: str):
+        """Enfileira uma linha completa para o arquivo do dia informado"""
+        if self._pendentes and dia != self._dia_pendente:
+            # Virada do dia: o lote anterior vai para o arquivo antigo
+            self.descarregar()
+        if not self._pendentes:
+            self._dia_pendente = dia
+            self._pendente_desde = time.monotonic()
+            
+        dados = linha.encode('utf-8')
+        self._pendentes.append(dados)
+        self._bytes_pendentes += len(dados)
+        
+        if self._bytes_pendentes >= self.tamanho_lote:
+            self.descarregar()
+        else:
+            self.descarregar_se_vencido()
+    
+    def descarregar_se_vencido(self):
+        """Descarrega o lote se ele está esperando há mais que intervalo_lote"""
+        if self._pendentes and time.monotonic() - self._pendente_desde >= self.intervalo_lote:
+            self.descarregar()
+    
+    def descarregar(self):
+        """Grava o lote pendente com uma única chamada write"""
+        if not self._pendentes:
+            return
+        fd = self._abrir(self._dia_pendente)
+        bloco = b''.join(self._pendentes)
+        self._pendentes = []
+        self._bytes_pendentes = 0
+        
+        # Com O_APPEND, um único write de linhas completas não se mistura com
+        # o de outros processos; o laço só repete em escrita parcial (disco cheio)
+        while bloco:
+            bloco = bloco[os.write(fd, bloco):]
+        if self.fsync:
+            os.fsync(fd)
+    
+    def _abrir(self, dia: str) -> int:
+        if dia != self._dia_aberto:
+            if self._fd is not None:
+                os.close(self._fd)
+            caminho = os.path.join(self.diretorio, f"eventos_{dia}.jsonl")
+            sinalizadores = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+            try:
+                self._fd = os.open(caminho, sinalizadores, 0o644)
+            except FileNotFoundError:
+                # Só cria o diretório quando ele falta (primeira execução)
+                os.makedirs(self.diretorio, exist_ok=True)
+                self._fd = os.open(caminho, sinalizadores, 0o644)
+            self._dia_aberto = dia
+        return self._fd
+    
+    def fechar(self):
+        """Descarrega o que falta e fecha o arquivo"""
+        self.descarregar()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            self._dia_aberto = None
 
 class GanchoBasico:
     """Classe base para implementação de ganchos em PT-BR"""
     
-    def __init__(self):
-        self.contexto = self.carregar_contexto()
-        self.diretorio_logs = Path('.claude/logs')
-        self.diretorio_logs.mkdir(parents=True, exist_ok=True)
+    def __init__(self, contexto: dict = None, escritor: EscritorEventos = None):
+        self.contexto = self.carregar_contexto() if contexto is None else contexto
+        # Diretório criado pelo escritor só se ainda não existir
+        self.diretorio_logs = '.claude/logs'
+        self.escritor = escritor or EscritorEventos(self.diretorio_logs)
         
     def carregar_contexto(self) -> dict:
         """Carrega contexto do stdin"""
+        import json
+        
         try:
             entrada = sys.stdin.read()
             return json.loads(entrada) if entrada else {}
         except json.JSONDecodeError:
             return {}
     
-    def registrar_evento(self, tipo_evento: str, dados: dict):
+    def registrar_evento(self, tipo_evento: str, dados: dict, agora=None):
         """Registra evento em arquivo de log"""
+        import json
+        from datetime import datetime
+        
+        # Um único instante para timestamp e nome do arquivo (virada da meia-noite)
+        agora = agora or datetime.now()
         evento = {
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': agora.isoformat(),
             'tipo': tipo_evento,
             'ferramenta': self.contexto.get('tool', 'desconhecida'),
             'dados': dados
         }
         
         # Salva em arquivo diário
-        arquivo_log = self.diretorio_logs / f"eventos_{datetime.now().strftime('%Y-%m-%d')}.jsonl"
-        
-        with open(arquivo_log, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(evento, ensure_ascii=False) + '\n')
+        self.escritor.escrever(
+            agora.strftime('%Y-%m-%d'),
+            json.dumps(evento, ensure_ascii=False) + '\n'
+        )
         
         return evento
     
@@ -54,13 +312,277 @@ class GanchoBasico:
             }
         )
         
+        self.escritor.fechar()
+        
         # Log para debug (remova em produção)
-        if Path('.claude/debug').exists():
+        if os.path.exists('.claude/debug'):
             print(f"[GANCHO] Evento registrado: {evento['tipo']}", file=sys.stderr)
         
         # Sempre retorna sucesso para não bloquear execução
         sys.exit(0)
 
+def executar_daemon():
+    """Servidor residente que recebe eventos pelo socket Unix"""
+    import fcntl
+    import json
+    import signal
+    import socketserver
+    import threading
+    
+    # Rotação opcional: requer rotacao_eventos.py ao lado deste arquivo
+    try:
+        from rotacao_eventos import rotacionar
+    except ImportError:
+        rotacionar = None
+    
+    os.makedirs('.claude/logs', exist_ok=True)
+    # Um escritor para todos os eventos: arquivo aberto e gravação em lote
+    escritor = EscritorEventos(
+        '.claude/logs',
+        tamanho_lote=TAMANHO_LOTE_DAEMON,
+        intervalo_lote=INTERVALO_LOTE_DAEMON
+    )
+    
+    # Só um daemon por projeto: a trava fica presa enquanto o processo vive
+    trava = open(CAMINHO_TRAVA, 'w')
+    try:
+        fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return
+    if os.path.exists(CAMINHO_SOCKET):
+        os.unlink(CAMINHO_SOCKET)
+    
+    class Atendente(socketserver.StreamRequestHandler):
+        def handle(self):
+            # Quadro: [tamanho: 4 bytes][evento]. Um quadro truncado (cliente que
+            # desistiu no meio do envio) é descartado sem registro
+            cabecalho = self.rfile.read(4)
+            if len(cabecalho) < 4:
+                return
+            tamanho = int.from_bytes(cabecalho, 'little')
+            entrada = self.rfile.read(tamanho)
+            if len(entrada) < tamanho:
+                return
+            # Confirma antes de registrar: se o cliente já desistiu e vai gravar
+            # direto, o envio falha e o evento não é registrado duas vezes
+            try:
+                self.wfile.write(CONFIRMACAO_DAEMON)
+                self.wfile.flush()
+            except OSError:
+                return
+            try:
+                contexto = json.loads(entrada) if entrada else {}
+            except json.JSONDecodeError:
+                contexto = {}
+            GanchoBasico(contexto, escritor=escritor).registrar_evento(
+                tipo_evento='execucao_ferramenta',
+                dados={
+                    'entrada': contexto.get('input', {}),
+                    'proposito': contexto.get('purpose', 'não especificado')
+                }
+            )
+            self.server.ultimo_evento = time.monotonic()
+    
+    # SIGTERM passa pelo finally e descarrega o lote pendente
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    servidor = socketserver.UnixStreamServer(CAMINHO_SOCKET, Atendente)
+    servidor.timeout = 1.0
+    servidor.ultimo_evento = time.monotonic()
+    proxima_rotacao = time.monotonic()
+    try:
+        while time.monotonic() - servidor.ultimo_evento < TEMPO_OCIOSO_DAEMON:
+            servidor.handle_request()
+            escritor.descarregar_se_vencido()
+            
+            if rotacionar is not None and time.monotonic() >= proxima_rotacao:
+                # Compressão roda em segundo plano para não atrasar eventos
+                threading.Thread(target=rotacionar, args=('.claude/logs',), daemon=True).start()
+                proxima_rotacao = time.monotonic() + INTERVALO_ROTACAO
+    finally:
+        servidor.server_close()
+        os.unlink(CAMINHO_SOCKET)
+        escritor.fechar()
+
+def iniciar_daemon(modo: str = '--servidor'):
+    """Sobe o daemon (ou o drenador) em segundo plano, sem esperar por ele"""
+    import subprocess
+    
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), modo],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+
+def executar_cliente():
+    """Cliente mínimo: repassa o stdin ao daemon e sai imediatamente"""
+    # _socket é o módulo C por trás de socket: evita importar enum, selectors etc.
+    import _socket
+    
+    entrada = sys.stdin.buffer.read()
+    try:
+        conexao = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+        try:
+            conexao.settimeout(TEMPO_LIMITE_CLIENTE)
+            conexao.connect(CAMINHO_SOCKET)
+            conexao.sendall(len(entrada).to_bytes(4, 'little') + entrada)
+            # Só conta como entregue depois da confirmação do daemon
+            if conexao.recv(len(CONFIRMACAO_DAEMON)) != CONFIRMACAO_DAEMON:
+                raise OSError('daemon não confirmou o evento')
+        finally:
+            conexao.close()
+    except OSError:
+        # Daemon ausente ou ocupado: inicia para os próximos eventos e grava
+        # este direto, sem bloquear a ferramenta
+        import json
+        
+        try:
+            iniciar_daemon()
+        except OSError:
+            pass
+        try:
+            contexto = json.loads(entrada) if entrada else {}
+        except json.JSONDecodeError:
+            contexto = {}
+        GanchoBasico(contexto).executar()
+        
+    if os.path.exists('.claude/debug'):
+        print("[GANCHO] Evento enviado ao daemon", file=sys.stderr)
+    sys.exit(0)
+
+def enviar_lote(eventos: list):
+    """Envia um lote já gravado para fora (coletor, fila, API); adapte aqui"""
+    pass
+
+def executar_spool():
+    """Deposita o evento no spool e retorna sem tocar nos arquivos de log"""
+    import fcntl
+    
+    entrada = sys.stdin.buffer.read()
+    try:
+        anel = AnelEventos()
+        anel.publicar(time.time_ns(), entrada)
+        anel.fechar()
+        
+        # Sem drenador vivo (trava livre), inicia um em segundo plano
+        trava = os.open(CAMINHO_TRAVA_DRENADOR, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            pass
+        else:
+            fcntl.flock(trava, fcntl.LOCK_UN)
+            iniciar_daemon('--drenar')
+        finally:
+            os.close(trava)
+    except OSError:
+        # Nunca bloqueia a ferramenta, mesmo com o spool indisponível
+        pass
+    sys.exit(0)
+
+def executar_drenador():
+    """Esvazia o spool em lotes: grava, enriquece e envia os eventos"""
+    import fcntl
+    import json
+    import signal
+    from datetime import datetime
+    
+    anel = AnelEventos()
+    trava = open(CAMINHO_TRAVA_DRENADOR, 'w')
+    try:
+        fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return
+    
+    # Lotes inteiros viram um único write no arquivo do dia
+    escritor = EscritorEventos('.claude/logs', tamanho_lote=TAMANHO_LOTE_DAEMON)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    descartados = anel.estado()['descartados']
+    ultimo_evento = time.monotonic()
+    
+    def processar(registros: list):
+        nonlocal descartados
+        agora_ns = time.time_ns()
+        eventos = []
+        invalidos = 0
+        for instante, entrada in registros:
+            # Os registros já saíram do anel: um evento ruim é contado e pulado,
+            # sem derrubar o drenador nem perder o resto do lote
+            try:
+                contexto = json.loads(entrada) if entrada else {}
+            except ValueError:
+                contexto = {}
+            if not isinstance(contexto, dict):
+                invalidos += 1
+                continue
+            eventos.append(GanchoBasico(contexto, escritor=escritor).registrar_evento(
+                tipo_evento='execucao_ferramenta',
+                dados={
+                    'entrada': contexto.get('input', {}),
+                    'proposito': contexto.get('purpose', 'não especificado'),
+                    'atraso_spool_ms': (agora_ns - instante) // 1_000_000
+                },
+                # Instante em que o gancho rodou, não o da drenagem
+                agora=datetime.fromtimestamp(instante / 1e9)
+            ))
+            
+        if invalidos:
+            GanchoBasico({'tool': 'spool'}, escritor=escritor).registrar_evento(
+                tipo_evento='spool_invalidos',
+                dados={'eventos_pulados': invalidos}
+            )
+            
+        # Descartes por spool cheio também entram no log, com os contadores
+        estado = anel.estado()
+        if estado['descartados'] > descartados:
+            GanchoBasico({'tool': 'spool'}, escritor=escritor).registrar_evento(
+                tipo_evento='spool_descartes',
+                dados={
+                    'novos_descartes': estado['descartados'] - descartados,
+                    'contadores': estado
+                }
+            )
+            descartados = estado['descartados']
+            
+        escritor.descarregar()
+        enviar_lote(eventos)
+    
+    try:
+        while time.monotonic() - ultimo_evento < TEMPO_OCIOSO_DAEMON:
+            registros = anel.consumir()
+            if not registros:
+                time.sleep(INTERVALO_DRENAGEM)
+                continue
+            ultimo_evento = time.monotonic()
+            processar(registros)
+            
+        # Uma última drenagem para o que chegou durante a checagem de ociosidade
+        registros = anel.consumir()
+        if registros:
+            processar(registros)
+            
+        # Um gancho que publicou depois disso viu a trava presa e não iniciou
+        # drenador: solta a trava e inicia outro se ainda houver eventos
+        fcntl.flock(trava, fcntl.LOCK_UN)
+        if anel.estado()['pendentes_bytes']:
+            iniciar_daemon('--drenar')
+    finally:
+        escritor.fechar()
+        anel.fechar()
+
 if __name__ == "__main__":
-    gancho = GanchoBasico()
-    gancho.executar()
\ No newline at end of file
+    if '--servidor' in sys.argv:
+        executar_daemon()
+    elif '--daemon' in sys.argv:
+        executar_cliente()
+    elif '--spool' in sys.argv:
+        executar_spool()
+    elif '--drenar' in sys.argv:
+        executar_drenador()
+    elif '--estado-spool' in sys.argv:
+        import json
+        print(json.dumps(AnelEventos().estado(), indent=2))
+    else:
+        gancho = GanchoBasico()
+        gancho.executar()
\ No newline at end of file
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+[TEMPLATE] [PORTUGUES-BR]
+Rotação, compressão e retenção dos logs de eventos do gancho básico
+Dias encerrados viram eventos_AAAA-MM-DD.jsonl.gz (ou .zst) em quadros
+independentes, com uma tabela de quadros ao lado para leitura por posição.
+Um arquivo que chega atrasado para um dia já comprimido vira quadros novos no
+fim do mesmo arquivo; até lá, o dia é lido como comprimido + ao vivo
+
+Exemplos:
+  python rotacao_eventos.py                       comprime dias encerrados
+  python rotacao_eventos.py --max-dias 30 --max-mb 500
+"""
+
+import argparse
+import bisect
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from datetime import date
+
+# zstd é opcional: sem o pacote zstandard a compressão usa gzip
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DIRETORIO_LOGS = '.claude/logs'
+EXTENSOES = {'gzip': '.gz', 'zstd': '.zst'}
+# Bytes descomprimidos por quadro: menor = leitura por posição mais barata
+TAMANHO_QUADRO = 1024 * 1024
+# Arquivo do dia anterior só é comprimido depois deste tempo sem escrita (segundos)
+ATRASO_ROTACAO = 600
+RETENCAO_DIAS = 90
+RETENCAO_BYTES = None
+
+PADRAO_ARQUIVO = re.compile(r'eventos_(\d{4}-\d{2}-\d{2})\.jsonl(\.gz|\.zst)?$')
+
+def arquivos_por_dia(diretorio: str = DIRETORIO_LOGS) -> list:
+    """Lista [(dia, caminho)] em ordem; um dia pode ter comprimido e ao vivo"""
+    encontrados = []
+    try:
+        nomes = os.listdir(diretorio)
+    except FileNotFoundError:
+        return []
+    for nome in nomes:
+        casamento = PADRAO_ARQUIVO.match(nome)
+        if casamento is not None:
+            encontrados.append((casamento.group(1), os.path.join(diretorio, nome)))
+    return sorted(encontrados)
+
+def ler_quadros(caminho: str) -> dict:
+    """Tabela de quadros de um arquivo comprimido
+    
+    quadros: [(início descomprimido, deslocamento comprimido)]; tamanho e
+    comprimido: bytes válidos antes e depois da compressão; origem: identidade
+    do último .jsonl consolidado. Tabelas antigas (só a lista) vêm sem os extras.
+    """
+    with open(caminho + '.quadros', encoding='utf-8') as f:
+        tabela = json.load(f)
+    if isinstance(tabela, list):
+        return {'quadros': tabela, 'tamanho': None, 'comprimido': None, 'origem': None}
+    return tabela
+
+def _identidade(caminho: str) -> list:
+    info = os.stat(caminho)
+    return [info.st_ino, info.st_size, info.st_mtime_ns]
+
+def tamanho_descomprimido(caminho: str, tabela: dict = None) -> int:
+    """Bytes descomprimidos de um dia comprimido"""
+    tabela = tabela or ler_quadros(caminho)
+    if tabela['tamanho'] is not None:
+        return tabela['tamanho']
+    # Tabela antiga: descomprime tudo uma vez e grava o tamanho na tabela
+    total = 0
+    with abrir_eventos(caminho) as fluxo:
+        for bloco in iter(lambda: fluxo.read(TAMANHO_QUADRO), b''):
+            total += len(bloco)
+    tabela = dict(tabela, tamanho=total, comprimido=os.path.getsize(caminho))
+    with open(caminho + '.quadros.tmp', 'w', encoding='utf-8') as f:
+        json.dump(tabela, f)
+    os.replace(caminho + '.quadros.tmp', caminho + '.quadros')
+    return total
+
+def partes_do_dia(diretorio: str, nome: str) -> list:
+    """[(início lógico, caminho)] que formam o dia eventos_*.jsonl, em ordem
+    
+    O comprimido vem primeiro; um .jsonl ao lado dele continua as posições a
+    partir do fim do comprimido, a menos que já tenha sido consolidado nele
+    (rotação interrompida entre gravar o comprimido e apagar o .jsonl).
+    """
+    ao_vivo = os.path.join(diretorio, nome)
+    partes = []
+    inicio = 0
+    origem = None
+    for extensao in EXTENSOES.values():
+        if os.path.exists(ao_vivo + extensao):
+            tabela = ler_quadros(ao_vivo + extensao)
+            partes.append((0, ao_vivo + extensao))
+            inicio = tamanho_descomprimido(ao_vivo + extensao, tabela)
+            origem = tabela['origem']
+            break
+    try:
+        if not partes or _identidade(ao_vivo) != origem:
+            partes.append((inicio, ao_vivo))
+    except FileNotFoundError:
+        pass
+    return partes
+
+def abrir_em(caminho: str, posicao: int):
+    """Abre uma parte do dia já posicionada em posicao (bytes descomprimidos)"""
+    if caminho.endswith('.jsonl'):
+        arquivo = open(caminho, 'rb')
+        arquivo.seek(posicao)
+        return arquivo
+
+    # A tabela de quadros leva direto ao quadro certo, sem descomprimir o início
+    quadros = ler_quadros(caminho)['quadros']
+    if not quadros:
+        return io.BytesIO()
+    indice = bisect.bisect_right([inicio for inicio, _ in quadros], posicao) - 1
+    inicio_quadro, deslocamento = quadros[max(indice, 0)]
+    arquivo = open(caminho, 'rb')
+    arquivo.seek(deslocamento)
+    if caminho.endswith('.gz'):
+        fluxo = gzip.GzipFile(fileobj=arquivo)
+        # GzipFile não fecha um fileobj recebido
+        fluxo.myfileobj = arquivo
+    else:
+        fluxo = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(
+            arquivo, read_across_frames=True, closefd=True
+        ))
+    fluxo.read(posicao - inicio_quadro)
+    return fluxo
+
+def abrir_eventos(caminho: str):
+    """Abre um arquivo de eventos ao vivo ou comprimido como fluxo binário"""
+    if caminho.endswith('.gz'):
+        return gzip.open(caminho, 'rb')
+    if caminho.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f"Pacote zstandard necessário para ler {caminho}")
+        leitor = zstandard.ZstdDecompressor().stream_reader(
+            open(caminho, 'rb'), read_across_frames=True, closefd=True
+        )
+        return io.BufferedReader(leitor)
+    return open(caminho, 'rb')
+
+def iterar_eventos(diretorio: str = DIRETORIO_LOGS, desde: str = None, ate: str = None):
+    """Percorre os eventos dia a dia, sem distinguir arquivos comprimidos e ao vivo"""
+    dias = sorted(set(dia for dia, _ in arquivos_por_dia(diretorio)))
+    for dia in dias:
+        if (desde and dia < desde[:10]) or (ate and dia > ate[:10]):
+            continue
+        for _, caminho in partes_do_dia(diretorio, f'eventos_{dia}.jsonl'):
+            with abrir_eventos(caminho) as fluxo:
+                for linha in fluxo:
+                    # Última linha do arquivo ao vivo pode estar incompleta
+                    if not linha.endswith(b'\n'):
+                        break
+                    try:
+                        yield json.loads(linha)
+                    except ValueError:
+                        continue
+
+def ler_linha_em(diretorio: str, nome: str, posicao: int) -> bytes:
+    """Lê a linha que começa em posicao (bytes descomprimidos) de eventos_*.jsonl"""
+    partes = partes_do_dia(diretorio, nome)
+    if not partes:
+        raise FileNotFoundError(os.path.join(diretorio, nome))
+    # Última parte que começa até a posição
+    inicio, caminho = [parte for parte in partes if parte[0] <= posicao][-1]
+    with abrir_em(caminho, posicao - inicio) as fluxo:
+        return fluxo.readline()
+
+def _comprimir_quadro(dados: bytes, formato: str) -> bytes:
+    if formato == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(dados)
+    # Cada membro gzip é independente; o arquivo continua legível por gzip/zcat
+    return gzip.compress(dados, mtime=0)
+
+def comprimir_arquivo(caminho: str, formato: str = 'gzip',
+                      tamanho_quadro: int = TAMANHO_QUADRO) -> str:
+    """Comprime um dia encerrado em quadros cortados em fim de linha
+    
+    Se o dia já tem arquivo comprimido, os quadros novos vão para o fim dele
+    (no formato dele) e a tabela de quadros é estendida.
+    """
+    for existente, extensao in EXTENSOES.items():
+        if os.path.exists(caminho + extensao):
+            formato = existente
+    destino = caminho + EXTENSOES[formato]
+    temporario = destino + '.tmp'
+    identidade = _identidade(caminho)
+    base = 0
+    quadros = []
+
+    if os.path.exists(destino):
+        tabela = ler_quadros(destino)
+        if tabela['origem'] == identidade:
+            # Rotação anterior parou antes de apagar o .jsonl já consolidado
+            os.unlink(caminho)
+            return destino
+        base = tamanho_descomprimido(destino, tabela)
+        quadros = tabela['quadros']
+        # Só os bytes que a tabela conhece: quadros de uma cópia interrompida ficam de fora
+        with open(destino, 'rb') as anterior, open(temporario, 'wb') as saida:
+            if tabela['comprimido'] is None:
+                shutil.copyfileobj(anterior, saida)
+            else:
+                saida.write(anterior.read(tabela['comprimido']))
+    else:
+        open(temporario, 'wb').close()
+
+    with open(caminho, 'rb') as origem, open(temporario, 'ab') as saida:
+        saida.seek(0, os.SEEK_END)
+        posicao = base
+        resto = b''
+        while True:
+            bloco = origem.read(tamanho_quadro)
+            dados = resto + bloco
+            if not dados:
+                break
+            corte = len(dados) if not bloco else dados.rfind(b'\n') + 1
+            if corte == 0:
+                # Nenhuma linha completa ainda: junta com o próximo bloco
+                resto = dados
+                continue
+            quadro, resto = dados[:corte], dados[corte:]
+            quadros.append((posicao, saida.tell()))
+            saida.write(_comprimir_quadro(quadro, formato))
+            posicao += len(quadro)
+        saida.flush()
+        os.fsync(saida.fileno())
+        comprimido = saida.tell()
+
+    # O comprimido novo começa com o antigo, então a tabela antiga continua
+    # válida até a nova entrar no lugar
+    os.replace(temporario, destino)
+    with open(destino + '.quadros.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'quadros': quadros, 'tamanho': posicao, 'comprimido': comprimido,
+                   'origem': identidade}, f)
+    os.replace(destino + '.quadros.tmp', destino + '.quadros')
+    os.unlink(caminho)
+    return destino
+
+def comprimir_dias_encerrados(diretorio: str = DIRETORIO_LOGS, formato: str = None,
+                              hoje: str = None) -> list:
+    """Comprime os arquivos de dias anteriores que já pararam de receber escrita"""
+    formato = formato or ('zstd' if zstandard is not None else 'gzip')
+    hoje = hoje or date.today().isoformat()
+    limite_mtime = time.time() - ATRASO_ROTACAO
+    comprimidos = []
+
+    for dia, caminho in arquivos_por_dia(diretorio):
+        if dia >= hoje or not caminho.endswith('.jsonl'):
+            continue
+        if os.path.getmtime(caminho) > limite_mtime:
+            # Um lote atrasado do daemon ainda pode chegar
+            continue
+        comprimidos.append(comprimir_arquivo(caminho, formato))
+    return comprimidos
+
+def aplicar_retencao(diretorio: str = DIRETORIO_LOGS, max_dias: int = RETENCAO_DIAS,
+                     max_bytes: int = RETENCAO_BYTES, hoje: str = None) -> list:
+    """Apaga os dias mais antigos por idade e, depois, por tamanho total"""
+    hoje = hoje or date.today().isoformat()
+    dias = [(dia, caminho) for dia, caminho in arquivos_por_dia(diretorio) if dia < hoje]
+    removidos = []
+
+    def remover(caminho: str):
+        for extra in ('', '.quadros'):
+            try:
+                os.unlink(caminho + extra)
+            except FileNotFoundError:
+                pass
+        removidos.append(caminho)
+
+    if max_dias is not None:
+        corte = date.fromordinal(date.fromisoformat(hoje).toordinal() - max_dias).isoformat()
+        while dias and dias[0][0] < corte:
+            remover(dias.pop(0)[1])
+
+    if max_bytes is not None:
+        # O arquivo de hoje conta no total, mas nunca é apagado
+        total = sum(os.path.getsize(caminho) for _, caminho in arquivos_por_dia(diretorio))
+        while dias and total > max_bytes:
+            _, caminho = dias.pop(0)
+            total -= os.path.getsize(caminho)
+            remover(caminho)
+
+    return removidos
+
+def rotacionar(diretorio: str = DIRETORIO_LOGS, formato: str = None,
+               max_dias: int = RETENCAO_DIAS, max_bytes: int = RETENCAO_BYTES) -> tuple:
+    """Compressão seguida de retenção; usado pelo daemon e pela linha de comando"""
+    comprimidos = comprimir_dias_encerrados(diretorio, formato)
+    removidos = aplicar_retencao(diretorio, max_dias, max_bytes)
+    return comprimidos, removidos
+
+def main():
+    parser = argparse.ArgumentParser(description='Rotação e retenção dos eventos do gancho')
+    parser.add_argument('--logs', default=DIRETORIO_LOGS, help='diretório dos eventos_*.jsonl')
+    parser.add_argument('--formato', choices=sorted(EXTENSOES), help='padrão: zstd se instalado')
+    parser.add_argument('--max-dias', type=int, default=RETENCAO_DIAS)
+    parser.add_argument('--max-mb', type=int, help='limite de espaço total em MB')
+    args = parser.parse_args()
+
+    if args.formato == 'zstd' and zstandard is None:
+        parser.error('formato zstd requer o pacote zstandard')
+    max_bytes = args.max_mb * 1024 * 1024 if args.max_mb else RETENCAO_BYTES
+    comprimidos, removidos = rotacionar(args.logs, args.formato, args.max_dias, max_bytes)
+    for caminho in comprimidos:
+        print(f"comprimido: {caminho}", file=sys.stderr)
+    for caminho in removidos:
+        print(f"removido: {caminho}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
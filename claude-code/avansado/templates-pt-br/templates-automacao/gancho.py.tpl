@@ -0,0 +1,12 @@
+
+# Gancho automático para: {{padrao}}
+import json
+import sys
+
+def processar_{{identificador}}():
+    contexto = json.loads(sys.stdin.read())
+    # Implementar lógica específica
+    print(f"Processando {{padrao}}: {contexto}")
+    
+if __name__ == "__main__":
+    processar_{{identificador}}()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+[GERADO] [PORTUGUES-BR] [MCP-SERVER]
+Servidor MCP para o padrão: {{padrao}}
+"""
+
+import json
+import sys
+
+def {{identificador}}(parametros: dict) -> dict:
+    # Implementar lógica específica
+    return {"sucesso": True, "padrao": {{padrao_literal}}, "parametros": parametros}
+
+FERRAMENTAS = [
+    {
+        "nome": "{{identificador}}",
+        "descricao": "Automação para: " + {{padrao_literal}},
+        "parametros": {}
+    }
+]
+
+def processar_mensagem(mensagem: dict) -> dict:
+    tipo_msg = mensagem.get("type")
+    
+    if tipo_msg == "initialize":
+        resposta = {
+            "type": "initialized",
+            "serverInfo": {"name": "{{identificador}}", "version": "0.1.0"},
+            "capabilities": {"tools": FERRAMENTAS}
+        }
+    elif tipo_msg == "tools/call" and mensagem.get("tool") == "{{identificador}}":
+        resposta = {"type": "tools/result", "result": {{identificador}}(mensagem.get("params", {}))}
+    else:
+        resposta = {"type": "error", "message": f"Tipo não suportado: {tipo_msg}"}
+        
+    if "id" in mensagem:
+        resposta["id"] = mensagem["id"]
+    return resposta
+
+if __name__ == "__main__":
+    for linha in sys.stdin:
+        print(json.dumps(processar_mensagem(json.loads(linha))), flush=True)
@@ -0,0 +1,5 @@
+
+#!/bin/bash
+# Script automático para: {{padrao}}
+echo "Executando automação: {{padrao}}"
+# Adicionar comandos específicos
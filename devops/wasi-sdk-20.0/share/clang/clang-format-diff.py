@@ -16,6 +16,14 @@ Example usage for git/svn users:
   git diff -U0 --no-color --relative HEAD^ | clang-format-diff.py -p1 -i
   svn diff --diff-cmd=diff -x-U0 | clang-format-diff.py -i
 
+With -j, files are formatted and diffed by a pool of worker processes. The
+output keeps the order of the input diff, and the first clang-format failure
+stops any further files from being started.
+
+Files whose formatted contents are identical to the original are skipped
+without diffing, and -i only rewrites files that actually change, so their
+modification times are kept.
+
 It should be noted that the filename contained in the diff is used unmodified
 to determine the source file to update. Users calling this script directly
 should be careful to ensure that the path in the diff is correct relative to the
@@ -25,15 +33,265 @@ from __future__ import absolute_import, division, print_function
 
 import argparse
 import difflib
-import re
+import locale
+import multiprocessing
 import subprocess
 import sys
 
+import clang_diff_parser
+
 if sys.version_info.major >= 3:
     from io import StringIO
 else:
     from io import BytesIO as StringIO
 
+# Files with more lines than this are diffed with PatienceMatcher.
+LARGE_FILE_LINES = 5000
+
+
+class PatienceMatcher(difflib.SequenceMatcher):
+  """SequenceMatcher whose matching blocks come from a patience diff.
+
+  Lines that occur exactly once on both sides anchor the match, and only the
+  gaps between anchors go through difflib's own matching. clang-format only
+  touches the requested ranges, so on a large file the gaps are small and the
+  cost stays close to linear instead of growing with the file size squared.
+  """
+
+  def get_matching_blocks(self):
+    if self.matching_blocks is not None:
+      return self.matching_blocks
+    blocks = []
+    self._match(0, len(self.a), 0, len(self.b), blocks)
+    # Join touching blocks and add the sentinel, like difflib does.
+    merged = []
+    for i, j, n in blocks:
+      if merged and merged[-1][0] + merged[-1][2] == i and \
+          merged[-1][1] + merged[-1][2] == j:
+        merged[-1][2] += n
+      elif n:
+        merged.append([i, j, n])
+    self.matching_blocks = [difflib.Match(i, j, n) for i, j, n in merged]
+    self.matching_blocks.append(difflib.Match(len(self.a), len(self.b), 0))
+    return self.matching_blocks
+
+  def _match(self, alo, ahi, blo, bhi, blocks):
+    a, b = self.a, self.b
+    # Common prefix and suffix.
+    start = 0
+    while alo + start < ahi and blo + start < bhi and \
+        a[alo + start] == b[blo + start]:
+      start += 1
+    if start:
+      blocks.append((alo, blo, start))
+    alo += start
+    blo += start
+    end = 0
+    while alo < ahi - end and blo < bhi - end and \
+        a[ahi - end - 1] == b[bhi - end - 1]:
+      end += 1
+    ahi -= end
+    bhi -= end
+    if alo < ahi and blo < bhi:
+      anchors = self._anchors(alo, ahi, blo, bhi)
+      if anchors:
+        i, j = alo, blo
+        for ai, bj in anchors:
+          self._match(i, ai, j, bj, blocks)
+          blocks.append((ai, bj, 1))
+          i, j = ai + 1, bj + 1
+        self._match(i, ahi, j, bhi, blocks)
+      else:
+        matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi])
+        for i, j, n in matcher.get_matching_blocks():
+          blocks.append((alo + i, blo + j, n))
+    if end:
+      blocks.append((ahi, bhi, end))
+
+  def _anchors(self, alo, ahi, blo, bhi):
+    """Longest increasing run of lines unique to both ranges."""
+    counts = {}
+    for i in range(alo, ahi):
+      line = self.a[i]
+      count = counts.get(line)
+      counts[line] = (i, None, 1) if count is None else (i, None, 2)
+    for j in range(blo, bhi):
+      count = counts.get(self.b[j])
+      if count is not None and count[2] == 1:
+        counts[self.b[j]] = (count[0], j, 1 if count[1] is None else 2)
+    pairs = sorted((i, j) for i, j, n in counts.values()
+                   if n == 1 and j is not None)
+    if not pairs:
+      return []
+
+    # Patience sorting: longest subsequence increasing in both files.
+    import bisect
+    tails = []
+    tail_pairs = []
+    previous = {}
+    for i, j in pairs:
+      k = bisect.bisect_left(tails, j)
+      previous[(i, j)] = tail_pairs[k - 1] if k else None
+      if k == len(tails):
+        tails.append(j)
+        tail_pairs.append((i, j))
+      else:
+        tails[k] = j
+        tail_pairs[k] = (i, j)
+    anchors = []
+    pair = tail_pairs[-1]
+    while pair is not None:
+      anchors.append(pair)
+      pair = previous[pair]
+    anchors.reverse()
+    return anchors
+
+
+def _format_range(start, stop):
+  beginning = start + 1
+  length = stop - start
+  if length == 1:
+    return '{}'.format(beginning)
+  if not length:
+    beginning -= 1
+  return '{},{}'.format(beginning, length)
+
+
+def unified_diff(code, formatted_code, filename):
+  """difflib.unified_diff, switching to PatienceMatcher on large files."""
+  if len(code) <= LARGE_FILE_LINES:
+    return ''.join(difflib.unified_diff(code, formatted_code,
+                                        filename, filename,
+                                        '(before formatting)',
+                                        '(after formatting)'))
+  output = []
+  matcher = PatienceMatcher(None, code, formatted_code, False)
+  for group in matcher.get_grouped_opcodes(3):
+    if not output:
+      output.append('--- {}\t(before formatting)\n'.format(filename))
+      output.append('+++ {}\t(after formatting)\n'.format(filename))
+    first, last = group[0], group[-1]
+    output.append('@@ -{} +{} @@\n'.format(_format_range(first[1], last[2]),
+                                            _format_range(first[3], last[4])))
+    for tag, i1, i2, j1, j2 in group:
+      if tag == 'equal':
+        output.extend(' ' + line for line in code[i1:i2])
+        continue
+      if tag in ('replace', 'delete'):
+        output.extend('-' + line for line in code[i1:i2])
+      if tag in ('replace', 'insert'):
+        output.extend('+' + line for line in formatted_code[j1:j2])
+  return ''.join(output)
+
+
+def _text_lines(data):
+  """Decodes like a text-mode open(): locale encoding, universal newlines."""
+  text = data.decode(locale.getpreferredencoding(False))
+  return StringIO(text.replace('\r\n', '\n').replace('\r', '\n')).readlines()
+
+
+def format_file(filename, lines, args):
+  """Runs clang-format on one file; returns (returncode, diff text)."""
+  # Even with -i, clang-format writes to stdout: the file is only rewritten
+  # below when its contents change.
+  command = [args.binary, filename]
+  if args.sort_includes:
+    command.append('-sort-includes')
+  command.extend(lines)
+  if args.style:
+    command.extend(['-style', args.style])
+  if args.fallback_style:
+    command.extend(['-fallback-style', args.fallback_style])
+
+  try:
+    p = subprocess.Popen(command,
+                         stdout=subprocess.PIPE,
+                         stderr=None,
+                         stdin=subprocess.PIPE)
+  except OSError as e:
+    # Give the user more context when clang-format isn't
+    # found/isn't executable, etc.
+    raise RuntimeError(
+      'Failed to run "%s" - %s"' % (" ".join(command), e.strerror))
+
+  stdout, stderr = p.communicate()
+  if p.returncode != 0:
+    return p.returncode, ''
+
+  with open(filename, 'rb') as f:
+    original = f.read()
+  # Most files come back unchanged: no diff and no write.
+  if original == stdout:
+    return 0, ''
+  if args.i:
+    with open(filename, 'wb') as f:
+      f.write(stdout)
+    return 0, ''
+  return 0, unified_diff(_text_lines(original), _text_lines(stdout), filename)
+
+
+def _announce(filename, args):
+  """Prints the -v message for filename before it is formatted."""
+  if args.i and args.verbose:
+    print('Formatting {}'.format(filename))
+    sys.stdout.flush()
+
+
+def format_files(lines_by_file, args, jobs):
+  """Yields (filename, returncode, diff text) in the order of lines_by_file.
+
+  With more than one job, files are handed to a process pool, which also
+  spreads the difflib work over several cores. Only as many files as there
+  are jobs are submitted at a time, and the first non-zero return code, in
+  whichever file it happens, stops new submissions. The files before the
+  failing one are still yielded in order, then the failure; files after it
+  are not reported.
+  """
+  if jobs == 1:
+    for filename, lines in lines_by_file.items():
+      _announce(filename, args)
+      returncode, diff_string = format_file(filename, lines, args)
+      yield filename, returncode, diff_string
+    return
+
+  from concurrent import futures
+  executor = futures.ProcessPoolExecutor(jobs)
+  items = list(lines_by_file.items())
+  in_flight = {}
+  results = {}
+  submitted = 0
+  next_index = 0
+  failed = None
+  try:
+    while True:
+      while failed is None and submitted < len(items) and \
+          len(in_flight) < jobs:
+        filename, lines = items[submitted]
+        _announce(filename, args)
+        in_flight[executor.submit(format_file, filename, lines, args)] = \
+            submitted
+        submitted += 1
+      if not in_flight:
+        break
+      done, _ = futures.wait(list(in_flight),
+                             return_when=futures.FIRST_COMPLETED)
+      for future in done:
+        index = in_flight.pop(future)
+        results[index] = future.result()
+        if results[index][0] != 0 and (failed is None or index < failed):
+          failed = index
+      # Files are submitted in order, so everything before a failure has
+      # been submitted and will be reported.
+      while next_index in results and (failed is None or
+                                       next_index <= failed):
+        returncode, diff_string = results.pop(next_index)
+        yield items[next_index][0], returncode, diff_string
+        next_index += 1
+  finally:
+    for future in in_flight:
+      future.cancel()
+    executor.shutdown(wait=True)
+
 
 def main():
   parser = argparse.ArgumentParser(description=__doc__,
@@ -65,80 +323,35 @@ def main():
                       'file to use.')
   parser.add_argument('-binary', default='clang-format',
                       help='location of binary to use for clang-format')
+  parser.add_argument('-j', type=int, default=1,
+                      help='number of files formatted in parallel '
+                      '(0 for one per CPU)')
   args = parser.parse_args()
 
-  # Extract changed lines for each file.
-  filename = None
+  # Extract changed lines for each file. Also format lines range if
+  # line_count is 0 in case of deleting surrounding statements.
+  ranges_by_file = clang_diff_parser.parse_diff(
+      getattr(sys.stdin, 'buffer', sys.stdin), args.p, args.regex, args.iregex,
+      keep_empty_hunks=True)
   lines_by_file = {}
-  for line in sys.stdin:
-    match = re.search(r'^\+\+\+\ (.*?/){%s}(\S*)' % args.p, line)
-    if match:
-      filename = match.group(2)
-    if filename is None:
-      continue
-
-    if args.regex is not None:
-      if not re.match('^%s$' % args.regex, filename):
-        continue
-    else:
-      if not re.match('^%s$' % args.iregex, filename, re.IGNORECASE):
-        continue
-
-    match = re.search(r'^@@.*\+(\d+)(,(\d+))?', line)
-    if match:
-      start_line = int(match.group(1))
-      line_count = 1
-      if match.group(3):
-        line_count = int(match.group(3))
-      # Also format lines range if line_count is 0 in case of deleting
-      # surrounding statements.
-      end_line = start_line
-      if line_count != 0:
-        end_line += line_count - 1
+  for filename, ranges in ranges_by_file.items():
+    for start_line, end_line in ranges:
       lines_by_file.setdefault(filename, []).extend(
           ['-lines', str(start_line) + ':' + str(end_line)])
 
+  jobs = args.j
+  if jobs == 0:
+    jobs = multiprocessing.cpu_count()
+  jobs = max(1, min(jobs, len(lines_by_file)))
+
   # Reformat files containing changes in place.
-  for filename, lines in lines_by_file.items():
-    if args.i and args.verbose:
-      print('Formatting {}'.format(filename))
-    command = [args.binary, filename]
-    if args.i:
-      command.append('-i')
-    if args.sort_includes:
-      command.append('-sort-includes')
-    command.extend(lines)
-    if args.style:
-      command.extend(['-style', args.style])
-    if args.fallback_style:
-      command.extend(['-fallback-style', args.fallback_style])
-
-    try:
-      p = subprocess.Popen(command,
-                           stdout=subprocess.PIPE,
-                           stderr=None,
-                           stdin=subprocess.PIPE,
-                           universal_newlines=True)
-    except OSError as e:
-      # Give the user more context when clang-format isn't
-      # found/isn't executable, etc.
-      raise RuntimeError(
-        'Failed to run "%s" - %s"' % (" ".join(command), e.strerror))
-
-    stdout, stderr = p.communicate()
-    if p.returncode != 0:
-      sys.exit(p.returncode)
-
-    if not args.i:
-      with open(filename) as f:
-        code = f.readlines()
-      formatted_code = StringIO(stdout).readlines()
-      diff = difflib.unified_diff(code, formatted_code,
-                                  filename, filename,
-                                  '(before formatting)', '(after formatting)')
-      diff_string = ''.join(diff)
-      if len(diff_string) > 0:
-        sys.stdout.write(diff_string)
+  results = format_files(lines_by_file, args, jobs)
+  for filename, returncode, diff_string in results:
+    if returncode != 0:
+      results.close()
+      sys.exit(returncode)
+    if len(diff_string) > 0:
+      sys.stdout.write(diff_string)
 
 if __name__ == '__main__':
   main()
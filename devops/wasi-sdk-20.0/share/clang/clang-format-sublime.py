@@ -11,11 +11,27 @@
 #
 # It operates on the current, potentially unsaved buffer and does not create
 # or save any files. To revert a formatting, just undo.
+#
+# clang-format runs on a background thread. Its result is dropped if the buffer
+# changed in the meantime, and otherwise only the replaced ranges are edited,
+# so undo history, folds and the viewport are kept.
+#
+# If clang_format_server.py is put next to this file, the requests go to a
+# persistent format broker (one per project folder) instead of starting
+# clang-format on every invocation. Set 'use_server' below to False to turn
+# that off.
 
 from __future__ import absolute_import, division, print_function
 import sublime
 import sublime_plugin
 import subprocess
+import threading
+from xml.etree import ElementTree
+
+try:
+  from . import clang_format_server
+except (ImportError, ValueError):
+  clang_format_server = None
 
 # Change this to the full path if clang-format is not on the path.
 binary = 'clang-format'
@@ -26,35 +42,96 @@ binary = 'clang-format'
 # used.
 style = None
 
+# Send the requests to the format broker when clang_format_server.py is
+# available.
+use_server = True
+
+def byte_offsets(text, offsets, encoding):
+  """Maps each character offset in offsets to its byte offset in text,
+  encoding each part of text once."""
+  result = {}
+  char_pos = byte_pos = 0
+  for offset in sorted(set(offsets)):
+    byte_pos += len(text[char_pos:offset].encode(encoding))
+    char_pos = offset
+    result[offset] = byte_pos
+  return result
+
+def parse_replacements(output, data, encoding):
+  """Turns -output-replacements-xml output for the bytes in data into
+  [start, end, text] character regions, last region first."""
+  root = ElementTree.fromstring(output)
+  replacements = sorted(
+      (int(r.get('offset')), int(r.get('length')), r.text or '')
+      for r in root.findall('replacement'))
+  # Convert byte offsets to character offsets in one pass over data.
+  regions = []
+  byte_pos = char_pos = 0
+  for offset, length, text in replacements:
+    char_pos += len(data[byte_pos:offset].decode(encoding))
+    start = char_pos
+    char_pos += len(data[offset:offset + length].decode(encoding))
+    byte_pos = offset + length
+    regions.append([start, char_pos, text])
+  regions.reverse()
+  return regions
+
 class ClangFormatCommand(sublime_plugin.TextCommand):
   def run(self, edit):
     encoding = self.view.encoding()
     if encoding == 'Undefined':
       encoding = 'utf-8'
-    regions = []
-    command = [binary]
+    buf = self.view.substr(sublime.Region(0, self.view.size()))
+    command = ['-output-replacements-xml']
     if style:
       command.extend(['-style', style])
-    for region in self.view.sel():
-      regions.append(region)
-      region_offset = min(region.a, region.b)
-      region_length = abs(region.b - region.a)
+    if self.view.file_name():
+      command.extend(['-assume-filename', self.view.file_name()])
+    selections = [(min(r.a, r.b), max(r.a, r.b)) for r in self.view.sel()]
+    offsets = byte_offsets(buf, [o for s in selections for o in s], encoding)
+    for begin, end in selections:
+      region_offset = offsets[begin]
+      region_length = offsets[end] - region_offset
       command.extend(['-offset', str(region_offset),
-                      '-length', str(region_length),
-                      '-assume-filename', str(self.view.file_name())])
-    old_viewport_position = self.view.viewport_position()
-    buf = self.view.substr(sublime.Region(0, self.view.size()))
-    p = subprocess.Popen(command, stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE, stdin=subprocess.PIPE)
-    output, error = p.communicate(buf.encode(encoding))
+                      '-length', str(region_length)])
+    folders = self.view.window().folders() if self.view.window() else []
+    workspace = folders[0] if folders else None
+    change_count = self.view.change_count()
+    thread = threading.Thread(target=self.format, args=(
+        command, buf.encode(encoding), encoding, workspace, change_count))
+    thread.daemon = True
+    thread.start()
+
+  def format(self, command, data, encoding, workspace, change_count):
+    """Runs clang-format off the UI thread and hands the result back."""
+    if use_server and clang_format_server:
+      _, output, error = clang_format_server.format_buffer(
+          binary, command, data, workspace=workspace)
+    else:
+      p = subprocess.Popen([binary] + command, stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE, stdin=subprocess.PIPE)
+      output, error = p.communicate(data)
     if error:
       print(error)
-    self.view.replace(
-        edit, sublime.Region(0, self.view.size()),
-        output.decode(encoding))
-    self.view.sel().clear()
-    for region in regions:
-      self.view.sel().add(region)
-    # FIXME: Without the 10ms delay, the viewport sometimes jumps.
-    sublime.set_timeout(lambda: self.view.set_viewport_position(
-      old_viewport_position, False), 10)
+    if not output:
+      return
+    try:
+      regions = parse_replacements(output, data, encoding)
+    except ElementTree.ParseError as e:
+      message = 'clang-format: unreadable replacements: %s' % e
+      print(message)
+      sublime.set_timeout(lambda: sublime.status_message(message), 0)
+      return
+    sublime.set_timeout(lambda: self.apply(regions, change_count), 0)
+
+  def apply(self, regions, change_count):
+    # The buffer was edited while clang-format ran; the result is stale.
+    if self.view.change_count() != change_count or not regions:
+      return
+    self.view.run_command('clang_format_apply', {'regions': regions})
+
+class ClangFormatApplyCommand(sublime_plugin.TextCommand):
+  """Replaces [start, end, text] regions, given last region first."""
+  def run(self, edit, regions):
+    for start, end, text in regions:
+      self.view.replace(edit, sublime.Region(start, end), text)
@@ -37,6 +37,19 @@
 #
 # It operates on the current, potentially unsaved buffer and does not create
 # or save any files. To revert a formatting, just undo.
+#
+# To send the requests to a persistent format broker instead of starting
+# clang-format on every key press, add to your .vimrc:
+#
+#   let g:clang_format_server = '<path-to-this-file>/clang_format_server.py'
+#
+# One broker is started per working directory and exits when idle. It caches
+# the style file of each directory; see clang_format_server.py.
+#
+# Run this file with python outside vim to benchmark the buffer diffing on a
+# large generated buffer:
+#
+#   python clang-format.py [lines]
 from __future__ import absolute_import, division, print_function
 
 import difflib
@@ -45,12 +58,17 @@ import os.path
 import platform
 import subprocess
 import sys
-import vim
+import time
+
+try:
+  import vim
+except ImportError:
+  vim = None
 
 # set g:clang_format_path to the path to clang-format if it is not on the path
 # Change this to the full path if clang-format is not on the path.
 binary = 'clang-format'
-if vim.eval('exists("g:clang_format_path")') == "1":
+if vim and vim.eval('exists("g:clang_format_path")') == "1":
   binary = vim.eval('g:clang_format_path')
 
 # Change this to format according to other formatting styles. See the output of
@@ -59,14 +77,56 @@ if vim.eval('exists("g:clang_format_path")') == "1":
 # used.
 style = None
 fallback_style = None
-if vim.eval('exists("g:clang_format_fallback_style")') == "1":
+if vim and vim.eval('exists("g:clang_format_fallback_style")') == "1":
   fallback_style = vim.eval('g:clang_format_fallback_style')
 
+# set g:clang_format_server to the path of clang_format_server.py to use the
+# format broker.
+server = None
+if vim and vim.eval('exists("g:clang_format_server")') == "1":
+  server_dir = os.path.dirname(vim.eval('g:clang_format_server'))
+  if server_dir not in sys.path:
+    sys.path.insert(0, server_dir)
+  import clang_format_server as server
+
 def get_buffer(encoding):
   if platform.python_version_tuple()[0] == '3':
-    return vim.current.buffer
+    return vim.current.buffer[:]
   return [ line.decode(encoding) for line in vim.current.buffer ]
 
+def changed_range(a, b):
+  """Returns (lo, a_hi, b_hi) such that a[lo:a_hi] and b[lo:b_hi] contain
+  every difference between the line lists a and b."""
+  end = min(len(a), len(b))
+  lo = 0
+  while lo < end and a[lo] == b[lo]:
+    lo += 1
+  a_hi, b_hi = len(a), len(b)
+  while a_hi > lo and b_hi > lo and a[a_hi - 1] == b[b_hi - 1]:
+    a_hi -= 1
+    b_hi -= 1
+  return lo, a_hi, b_hi
+
+def get_opcodes(a, b):
+  """Like SequenceMatcher(None, a, b).get_opcodes() without 'equal' entries,
+  but only the lines between the common prefix and suffix are matched."""
+  lo, a_hi, b_hi = changed_range(a, b)
+  if lo == a_hi and lo == b_hi:
+    return []
+  sequence = difflib.SequenceMatcher(None, a[lo:a_hi], b[lo:b_hi])
+  return [(tag, i1 + lo, i2 + lo, j1 + lo, j2 + lo)
+          for tag, i1, i2, j1, j2 in sequence.get_opcodes() if tag != 'equal']
+
+def cursor_offset(text, line, col):
+  """Converts a 1-based (line, col) to a byte offset in text."""
+  offset = 0
+  for _ in range(line - 1):
+    newline = text.find(b'\n', offset)
+    if newline < 0:
+      break
+    offset = newline + 1
+  return offset + col - 1
+
 def main():
   # Get the current text.
   encoding = vim.eval("&encoding")
@@ -79,12 +139,15 @@ def main():
     lines = ['-lines', vim.eval('l:lines')]
   elif vim.eval('exists("l:formatdiff")') == '1' and \
        os.path.exists(vim.current.buffer.name):
+    # Nothing changed since the last format of this buffer.
+    if vim.eval('get(b:, "clang_format_changedtick", -1)') == \
+        vim.eval('b:changedtick'):
+      return
     with open(vim.current.buffer.name, 'r') as f:
       ondisk = f.read().splitlines();
-    sequence = difflib.SequenceMatcher(None, ondisk, vim.current.buffer)
     lines = []
-    for op in reversed(sequence.get_opcodes()):
-      if op[0] not in ['equal', 'delete']:
+    for op in reversed(get_opcodes(ondisk, vim.current.buffer[:])):
+      if op[0] != 'delete':
         lines += ['-lines', '%s:%s' % (op[3] + 1, op[4])]
     if lines == []:
       return
@@ -95,10 +158,7 @@ def main():
   # Convert cursor (line, col) to bytes.
   # Don't use line2byte: https://github.com/vim/vim/issues/5930
   _, cursor_line, cursor_col, _ = vim.eval('getpos(".")') # 1-based
-  cursor_byte = 0
-  for line in text.split(b'\n')[:int(cursor_line) - 1]:
-    cursor_byte += len(line) + 1
-  cursor_byte += int(cursor_col) - 1
+  cursor_byte = cursor_offset(text, int(cursor_line), int(cursor_col))
   if cursor_byte < 0:
     print('Couldn\'t determine cursor position. Is your file empty?')
     return
@@ -111,7 +171,7 @@ def main():
     startupinfo.wShowWindow = subprocess.SW_HIDE
 
   # Call formatter.
-  command = [binary, '-cursor', str(cursor_byte)]
+  command = ['-cursor', str(cursor_byte)]
   if lines != ['-lines', 'all']:
     command += lines
   if style:
@@ -120,10 +180,14 @@ def main():
     command.extend(['-fallback-style', fallback_style])
   if vim.current.buffer.name:
     command.extend(['-assume-filename', vim.current.buffer.name])
-  p = subprocess.Popen(command,
-                       stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                       stdin=subprocess.PIPE, startupinfo=startupinfo)
-  stdout, stderr = p.communicate(input=text)
+  if server:
+    _, stdout, stderr = server.format_buffer(binary, command, text,
+                                             startupinfo=startupinfo)
+  else:
+    p = subprocess.Popen([binary] + command,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         stdin=subprocess.PIPE, startupinfo=startupinfo)
+    stdout, stderr = p.communicate(input=text)
 
   # If successful, replace buffer contents.
   if stderr:
@@ -141,10 +205,10 @@ def main():
     # This maintains trailing empty lines present in the buffer if
     # the -lines specification requests them to remain unchanged.
     lines = content.decode(encoding).split('\n')[:-1]
-    sequence = difflib.SequenceMatcher(None, buf, lines)
-    for op in reversed(sequence.get_opcodes()):
-      if op[0] != 'equal':
-        vim.current.buffer[op[1]:op[2]] = lines[op[3]:op[4]]
+    for op in reversed(get_opcodes(buf, lines)):
+      vim.current.buffer[op[1]:op[2]] = lines[op[3]:op[4]]
+    if vim.eval('exists("l:formatdiff")') == '1':
+      vim.command('let b:clang_format_changedtick = b:changedtick')
     if header.get('IncompleteFormat'):
       print('clang-format: incomplete (syntax errors)')
     # Convert cursor bytes to (line, col)
@@ -155,4 +219,38 @@ def main():
     cursor_column = 1 + len(prefix.rsplit(b'\n', 1)[-1])
     vim.command('call cursor(%d, %d)' % (cursor_line, cursor_column))
 
-main()
+def benchmark(count):
+  """Times the old whole-buffer diffing against get_opcodes() on a buffer of
+  count lines with a few edited lines in the middle."""
+  buf = ['  int value%d = compute(%d) + offset;' % (i, i % 97)
+         for i in range(count)]
+  formatted = list(buf)
+  middle = count // 2
+  formatted[middle:middle + 3] = ['  int value = compute(0)', '      + offset;']
+  text = ('\n'.join(buf) + '\n').encode('utf-8')
+
+  start = time.time()
+  old_cursor = 0
+  for line in text.split(b'\n')[:middle]:
+    old_cursor += len(line) + 1
+  old_ops = [op for op in difflib.SequenceMatcher(
+                 None, buf, formatted).get_opcodes() if op[0] != 'equal']
+  old_time = time.time() - start
+
+  start = time.time()
+  new_cursor = cursor_offset(text, middle + 1, 1)
+  new_ops = get_opcodes(buf, formatted)
+  new_time = time.time() - start
+
+  print('%d lines' % count)
+  print('whole buffer:  %8.2fms' % (old_time * 1000))
+  print('changed range: %8.2fms (%.1fx)' %
+        (new_time * 1000, old_time / max(new_time, 1e-9)))
+  if old_cursor != new_cursor or old_ops != new_ops:
+    print('results differ from the whole-buffer diff')
+    sys.exit(1)
+
+if vim:
+  main()
+elif __name__ == '__main__':
+  benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
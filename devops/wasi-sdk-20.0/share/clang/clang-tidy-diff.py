@@ -21,21 +21,58 @@ Example usage for git/svn users:
   svn diff --diff-cmd=diff -x-U0 | \
       clang-tidy-diff.py -fix -checks=-*,modernize-use-override
 
+With -cache-dir, results are kept in a content-addressed cache so files whose
+source, included headers, compile command, clang-tidy version and arguments are
+unchanged are not checked again:
+
+  git diff -U0 HEAD^ | clang-tidy-diff.py -p1 -cache-dir ~/.cache/tidy-diff
+
+With -format=jsonl or -format=sarif, diagnostics are parsed while clang-tidy
+runs and written as one JSON record (or SARIF result) each, as soon as they
+are complete. Diagnostics repeated by several translation units, typically in
+shared headers, are written once.
+
+With -workers, the files are split into one shard per worker using the -path
+compile database, keeping files that share a precompiled header (or build
+target) together, and checked by clang-tidy-diff.py processes started with
+-serve. Diagnostics and fixes are streamed back and merged as usual; files of
+a worker that fails are checked locally. Workers need the same checkout and
+build tree at the same paths. Every request must carry the shared secret
+given with -worker-token (or $CLANG_TIDY_DIFF_WORKER_TOKEN), and workers
+refuse arguments that load plugins or name output files. The connection is
+not encrypted, so only expose workers on trusted networks. -fix cannot be
+combined with -workers, since the fixes would be applied to the workers'
+trees:
+
+  export CLANG_TIDY_DIFF_WORKER_TOKEN=$(openssl rand -hex 16)
+  clang-tidy-diff.py -serve 7001 -j 8 -cache-dir ~/.cache/tidy-diff &
+  clang-tidy-diff.py -serve 7002 -j 8 -cache-dir ~/.cache/tidy-diff &
+  git diff -U0 HEAD^ | clang-tidy-diff.py -p1 -path build \
+      -workers 127.0.0.1:7001,127.0.0.1:7002
+
 """
 
 import argparse
 import glob
+import hashlib
+import heapq
+import hmac
 import json
 import multiprocessing
 import os
 import re
+import shlex
 import shutil
+import socket
 import subprocess
 import sys
 import tempfile
 import threading
+import time
 import traceback
 
+import clang_diff_parser
+
 try:
   import yaml
 except ImportError:
@@ -45,31 +82,965 @@ is_py2 = sys.version[0] == '2'
 
 if is_py2:
     import Queue as queue
+    import SocketServer as socketserver
 else:
     import queue as queue
+    import socketserver
 
 
-def run_tidy(task_queue, lock, timeout):
-  watchdog = None
+INCLUDE_RE = re.compile(
+    br'^[ \t]*#[ \t]*(include_next|include|import)[ \t]*([<"])([^>"\n]+)[>"]',
+    re.MULTILINE)
+
+# Compiler flags that include a file before the source; -include-pch names
+# the precompiled header rather than the header itself.
+FORCED_INCLUDE_FLAGS = ('-include-pch', '-include', '-imacros', '/FI')
+
+
+def load_compile_database(directory, build_path=None):
+  """Loads the compilation database clang-tidy would use for a directory.
+
+  Returns {normalized source path: entry}, or None if there is none. Without
+  build_path, the parent directories are searched like clang-tidy does.
+  """
+  current = build_path if build_path is not None else directory
   while True:
-    command = task_queue.get()
+    candidate = os.path.join(current, 'compile_commands.json')
+    if os.path.exists(candidate):
+      with open(candidate) as f:
+        entries = json.load(f)
+      database = {}
+      for entry in entries:
+        path = os.path.normpath(os.path.join(entry['directory'],
+                                             entry['file']))
+        database[path] = entry
+      return database
+    parent = os.path.dirname(current)
+    if build_path is not None or parent == current:
+      return None
+    current = parent
+
+
+def compile_arguments(entry):
+  return entry.get('arguments') or shlex.split(entry['command'])
+
+
+class ResultCache(object):
+  """On-disk cache of clang-tidy results, keyed by everything that affects them.
+
+  The key hashes the clang-tidy version, the command line (including the line
+  filter), the compile command from the compilation database, the contents of
+  the source file and of every header it includes that can be found on its
+  include paths, and any .clang-tidy files above it. Forced includes
+  (-include, -imacros, /FI) start the closure next to the source, a
+  precompiled header is hashed as a file, and #include_next takes every match
+  on the include paths. Conditional includes are followed unconditionally, so
+  the key may change more often than needed but never less.
+
+  Entries are evicted least recently used first once the cache grows past
+  max_size bytes.
+  """
+
+  def __init__(self, directory, clang_tidy_binary, build_path, max_size):
+    self.directory = directory
+    self.build_path = build_path
+    self.max_size = max_size
+    self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+    self.lock = threading.Lock()
+    self.file_digests = {}
+    self.databases = {}
+    version = subprocess.check_output([clang_tidy_binary, '--version'])
+    self.salt = hashlib.sha256(version).hexdigest()
+
+  def _digest(self, path):
+    """Returns the digest of a file without scanning it for includes."""
+    try:
+      h = hashlib.sha256()
+      with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1048576), b''):
+          h.update(block)
+      return h.hexdigest()
+    except (IOError, OSError):
+      return 'missing'
+
+  def _scan(self, path):
+    """Returns (digest, [(directive, bracket, include)]) for a file, reading
+    it once."""
+    cached = self.file_digests.get(path)
+    if cached is None:
+      try:
+        with open(path, 'rb') as f:
+          content = f.read()
+      except (IOError, OSError):
+        content = None
+      if content is None:
+        cached = ('missing', [])
+      else:
+        cached = (hashlib.sha256(content).hexdigest(),
+                  INCLUDE_RE.findall(content))
+      self.file_digests[path] = cached
+    return cached
+
+  def _database(self, directory, build_path):
+    """Loads the compilation database clang-tidy would use for a directory."""
+    if build_path is not None:
+      directory = build_path
+    key = (directory, build_path is not None)
+    if key not in self.databases:
+      self.databases[key] = load_compile_database(directory, build_path)
+    return self.databases[key]
+
+  def refresh(self):
+    """Forgets file digests and compilation databases read so far, so a
+    long-running worker sees edits made between shards."""
+    self.file_digests = {}
+    self.databases = {}
+
+  def _build_path(self, command, cwd):
+    """Returns the -p build path clang-tidy is run with, resolved against
+    cwd, falling back to the cache's own build path."""
+    build_path = None
+    for i, arg in enumerate(command):
+      if arg in ('-p', '--p') and i + 1 < len(command):
+        build_path = command[i + 1]
+      elif arg.startswith(('-p=', '--p=')):
+        build_path = arg.split('=', 1)[1]
+      elif arg == '--':
+        break
+    if build_path is None:
+      return self.build_path
+    return os.path.normpath(os.path.join(cwd or os.getcwd(), build_path))
+
+  def _compile_command(self, path, build_path):
+    """Returns (command, include paths, forced includes) for a source file."""
+    database = self._database(os.path.dirname(path), build_path)
+    entry = database.get(path) if database else None
+    if entry is None:
+      return None, [], []
+    arguments = compile_arguments(entry)
+    include_paths = []
+    forced = []
+    pending = None
+    for arg in [arg for arg in arguments if arg != '-Xclang']:
+      if pending is not None:
+        (forced if pending in FORCED_INCLUDE_FLAGS else
+         include_paths).append((pending, arg))
+        pending = None
+        continue
+      for flag in FORCED_INCLUDE_FLAGS + ('-iquote', '-isystem', '-I'):
+        if arg == flag:
+          pending = flag
+        elif arg.startswith(flag + '=') or (
+            arg.startswith(flag) and flag in ('-iquote', '-isystem', '-I',
+                                              '/FI')):
+          (forced if flag in FORCED_INCLUDE_FLAGS else
+           include_paths).append((flag, arg[len(flag):].lstrip('=')))
+        else:
+          continue
+        break
+    include_paths = [(flag, os.path.normpath(os.path.join(entry['directory'],
+                                                          directory)))
+                     for flag, directory in include_paths]
+    return ([entry['directory']] + arguments, include_paths,
+            [(flag, os.path.join(entry['directory'], name))
+             for flag, name in forced])
+
+  def _forced_roots(self, forced, include_paths):
+    """Resolves forced includes to files the closure starts from."""
+    roots = []
+    pch_files = []
+    for flag, name in forced:
+      if flag == '-include-pch':
+        # The precompiled header, and the header it was built from when it
+        # sits next to it (header.h.pch or header.h.gch).
+        pch_files.append(os.path.normpath(name))
+        header = os.path.splitext(name)[0]
+        if os.path.isfile(header):
+          roots.append(os.path.normpath(header))
+        continue
+      candidates = [name] + [os.path.join(directory, os.path.basename(name))
+                             for _, directory in include_paths]
+      for candidate in candidates:
+        if os.path.isfile(candidate):
+          roots.append(os.path.normpath(candidate))
+          break
+      else:
+        roots.append('<%s>' % name)
+    return roots, pch_files
+
+  def _include_closure(self, path, include_paths, roots=()):
+    quoted = [d for flag, d in include_paths if flag == '-iquote']
+    angled = [d for flag, d in include_paths if flag != '-iquote']
+    closure = {}
+    pending = [path]
+    for root in roots:
+      if root.startswith('<'):
+        closure[root] = 'unresolved'
+      else:
+        pending.append(root)
+    while pending:
+      current = pending.pop()
+      if current in closure:
+        continue
+      digest, includes = self._scan(current)
+      closure[current] = digest
+      for directive, bracket, name in includes:
+        name = name.decode('utf-8', 'replace')
+        directories = angled
+        if bracket == b'"':
+          directories = [os.path.dirname(current)] + quoted + angled
+        found = False
+        for directory in directories:
+          candidate = os.path.normpath(os.path.join(directory, name))
+          if os.path.isfile(candidate):
+            pending.append(candidate)
+            found = True
+            # #include_next continues the search past the including
+            # directory; every later match may be the one used.
+            if directive != b'include_next':
+              break
+        if not found:
+          # Not on the include paths (usually a system header): only the
+          # spelling can be part of the key.
+          closure['<%s>' % name] = 'unresolved'
+    return closure
+
+  def _configs(self, path):
+    configs = []
+    current = os.path.dirname(path)
+    while True:
+      candidate = os.path.join(current, '.clang-tidy')
+      if os.path.exists(candidate):
+        configs.append((candidate, self._scan(candidate)[0]))
+      parent = os.path.dirname(current)
+      if parent == current:
+        return configs
+      current = parent
+
+  def key(self, name, command, cwd=None):
+    """Returns the cache key of checking name with command, run in cwd.
+
+    The compilation database is the one the command's -p selects, so a
+    worker keys the files of a coordinator by the coordinator's build tree.
+    """
+    path = os.path.normpath(os.path.join(cwd or os.getcwd(), name))
+    compile_command, include_paths, forced = self._compile_command(
+        path, self._build_path(command, cwd))
+    roots, pch_files = self._forced_roots(forced, include_paths)
+    closure = self._include_closure(path, include_paths, roots)
+    for pch in pch_files:
+      # Binary: hashed, never scanned for includes.
+      closure[pch] = self._digest(pch)
+    h = hashlib.sha256()
+    for part in (self.salt, path, command, compile_command,
+                 sorted(closure.items()), self._configs(path)):
+      h.update(json.dumps(part).encode('utf-8'))
+      h.update(b'\0')
+    return h.hexdigest()
+
+  def _path(self, key):
+    return os.path.join(self.directory, key[:2], key + '.json')
+
+  def get(self, key):
+    path = self._path(key)
+    try:
+      with open(path) as f:
+        result = json.load(f)
+      # The modification time is the LRU clock.
+      os.utime(path, None)
+    except (IOError, OSError, ValueError):
+      with self.lock:
+        self.stats['misses'] += 1
+      return None
+    with self.lock:
+      self.stats['hits'] += 1
+    return result
+
+  def put(self, key, result):
+    path = self._path(key)
+    try:
+      if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    except OSError:
+      pass
+    (handle, tmp_name) = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(handle, 'w') as f:
+      json.dump(result, f)
+    os.rename(tmp_name, path)
+    with self.lock:
+      self.stats['stores'] += 1
+
+  def evict(self):
+    """Removes the least recently used entries until the cache fits again."""
+    entries = []
+    total = 0
+    for path in glob.iglob(os.path.join(self.directory, '*', '*.json')):
+      try:
+        st = os.stat(path)
+      except OSError:
+        continue
+      entries.append((st.st_mtime, st.st_size, path))
+      total += st.st_size
+    if total <= self.max_size:
+      return total
+    entries.sort()
+    # Shrink to 90% so that the next runs do not evict on every store.
+    target = self.max_size * 0.9
+    for _, size, path in entries:
+      if total <= target:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        continue
+      total -= size
+      self.stats['evictions'] += 1
+    return total
+
+  def report(self, total):
+    lookups = self.stats['hits'] + self.stats['misses']
+    rate = 100.0 * self.stats['hits'] / lookups if lookups else 0.0
+    sys.stderr.write('Result cache: %d hits, %d misses (%.1f%%), %d stored, '
+                     '%d evicted, %.1f MB used\n' %
+                     (self.stats['hits'], self.stats['misses'], rate,
+                      self.stats['stores'], self.stats['evictions'],
+                      total / 1048576.0))
+
+
+class RuntimeHistory(object):
+  """Per-file clang-tidy runtimes from earlier runs, used to order the work.
+
+  Files without history are estimated from their size, scaled by the average
+  seconds per byte seen so far.
+  """
+
+  # Weight of the newest measurement in the moving average.
+  ALPHA = 0.5
+
+  def __init__(self, path):
+    self.path = path
+    self.runtimes = {}
+    self.measured = {}
+    self.lock = threading.Lock()
+    if path is not None and os.path.exists(path):
+      try:
+        with open(path) as f:
+          self.runtimes = json.load(f)
+      except ValueError:
+        sys.stderr.write('Ignoring unreadable timing history %s\n' % path)
+
+  def _seconds_per_byte(self):
+    ratios = []
+    for path, (seconds, size) in self.runtimes.items():
+      if size:
+        ratios.append(seconds / size)
+    if not ratios:
+      return None
+    return sorted(ratios)[len(ratios) // 2]
+
+  def estimate(self, names):
+    """Returns ({name: cost}, unit) with cost in seconds when possible."""
+    per_byte = self._seconds_per_byte()
+    costs = {}
+    for name in names:
+      path = os.path.abspath(name)
+      try:
+        size = os.path.getsize(path)
+      except OSError:
+        size = 0
+      if path in self.runtimes:
+        costs[name] = self.runtimes[path][0]
+      elif per_byte is not None:
+        costs[name] = size * per_byte
+      else:
+        costs[name] = size
+    unit = 'bytes' if per_byte is None else 'seconds'
+    if per_byte is None and any(os.path.abspath(n) in self.runtimes
+                                for n in names):
+      unit = 'mixed'
+    return costs, unit
+
+  def record(self, name, seconds):
+    path = os.path.abspath(name)
+    try:
+      size = os.path.getsize(path)
+    except OSError:
+      size = 0
+    with self.lock:
+      self.measured[path] = (seconds, size)
+
+  def save(self):
+    if self.path is None or not self.measured:
+      return
+    for path, (seconds, size) in self.measured.items():
+      if path in self.runtimes:
+        seconds = (self.ALPHA * seconds +
+                   (1 - self.ALPHA) * self.runtimes[path][0])
+      self.runtimes[path] = (seconds, size)
+    directory = os.path.dirname(os.path.abspath(self.path))
+    (handle, tmp_name) = tempfile.mkstemp(dir=directory)
+    with os.fdopen(handle, 'w') as f:
+      json.dump(self.runtimes, f)
+    os.rename(tmp_name, self.path)
+
+
+def schedule_longest_first(costs, workers):
+  """Orders files longest first and simulates the run on a worker pool.
+
+  Returns the order and the expected critical path as (makespan, longest
+  file), where makespan is the finish time of the busiest worker.
+  """
+  order = sorted(costs, key=lambda name: (-costs[name], name))
+  finish_times = [0.0] * workers
+  for name in order:
+    heapq.heapreplace(finish_times, finish_times[0] + costs[name])
+  longest = order[0] if order else None
+  return order, (max(finish_times) if order else 0.0, longest)
+
+
+# Compiler flags naming a precompiled or forced-include header, strongest
+# first. Files built with the same one are kept on the same worker.
+PCH_FLAGS = ('-include-pch', '/Fp', '/Yu', '-include')
+
+
+def precompiled_header(entry):
+  """Returns the precompiled header a compile command uses, or None."""
+  arguments = [arg for arg in compile_arguments(entry) if arg != '-Xclang']
+  found = {}
+  for i, arg in enumerate(arguments):
+    for flag in PCH_FLAGS:
+      if arg == flag:
+        value = arguments[i + 1] if i + 1 < len(arguments) else ''
+      elif arg.startswith(flag + '=') or (flag.startswith('/') and
+                                          arg.startswith(flag)):
+        value = arg[len(flag):].lstrip('=')
+      else:
+        continue
+      found.setdefault(flag, value)
+      break
+  for flag in PCH_FLAGS:
+    if found.get(flag):
+      return os.path.normpath(os.path.join(entry['directory'], found[flag]))
+  return None
+
+
+def build_target(entry):
+  """Returns the CMake target directory ('<name>.dir') of a compile command's
+  output file, or None."""
+  arguments = compile_arguments(entry)
+  output = entry.get('output')
+  for i, arg in enumerate(arguments[:-1]):
+    if arg == '-o':
+      output = arguments[i + 1]
+  while output:
+    output, part = os.path.split(output)
+    if part.endswith('.dir'):
+      return os.path.normpath(os.path.join(entry['directory'], output, part))
+    if not part:
+      break
+  return None
+
+
+def shard_by_compile_database(names, costs, build_path, count):
+  """Splits files into count shards of about equal cost.
+
+  Files that use the same precompiled header go to the same shard, or,
+  failing that, files of the same build target or directory, so each worker
+  reuses what the others would have to load again. A group costing more than
+  one shard's share is split so that the shards stay balanced. Each shard is
+  ordered longest first.
+  """
+  databases = {}
+  groups = {}
+  for name in names:
+    path = os.path.abspath(name)
+    directory = build_path if build_path is not None else os.path.dirname(path)
+    if directory not in databases:
+      databases[directory] = load_compile_database(directory, build_path)
+    entry = (databases[directory] or {}).get(path)
+    key = os.path.dirname(path)
+    if entry is not None:
+      key = precompiled_header(entry) or build_target(entry) or key
+    groups.setdefault(key, []).append(name)
+
+  share = sum(costs.values()) / float(count)
+  pieces = []
+  for key in sorted(groups):
+    piece, piece_cost = [], 0.0
+    for name in sorted(groups[key], key=lambda n: (-costs[n], n)):
+      if piece and piece_cost + costs[name] > share:
+        pieces.append((piece_cost, piece))
+        piece, piece_cost = [], 0.0
+      piece.append(name)
+      piece_cost += costs[name]
+    pieces.append((piece_cost, piece))
+
+  # Largest piece to the least loaded shard.
+  shards = [(0.0, i, []) for i in range(count)]
+  for piece_cost, piece in sorted(pieces, key=lambda p: (-p[0], p[1])):
+    load, i, shard = heapq.heappop(shards)
+    shard.extend(piece)
+    heapq.heappush(shards, (load + piece_cost, i, shard))
+  return [sorted(shard, key=lambda n: (-costs[n], n))
+          for _, _, shard in sorted(shards, key=lambda s: s[1])]
+
+
+# Options a worker refuses to pass on: they load code into clang-tidy or the
+# compiler, or write to files chosen by the coordinator. Options given through
+# -extra-arg and -extra-arg-before are checked too.
+WORKER_FORBIDDEN_OPTIONS = ('load', 'export-fixes', 'fplugin', 'fpass-plugin')
+
+# Seconds a worker waits for a coordinator to send its request.
+WORKER_REQUEST_TIMEOUT = 30
+
+
+def forbidden_worker_argument(args):
+  """Returns the first of args a worker must not run, or None."""
+  previous = None
+  for arg in args:
+    option = arg
+    for prefix in ('-extra-arg=', '--extra-arg=', '-extra-arg-before=',
+                   '--extra-arg-before='):
+      if option.startswith(prefix):
+        option = option[len(prefix):]
+    name = option.lstrip('-').split('=', 1)[0]
+    if option.startswith('-') and name in WORKER_FORBIDDEN_OPTIONS:
+      return arg
+    # -Xclang -load, -Xclang -plugin and -Xclang -add-plugin.
+    if previous == 'Xclang' and name in ('load', 'plugin', 'add-plugin'):
+      return arg
+    previous = name if option.startswith('-') else None
+  return None
+
+
+def parse_address(address):
+  """Splits '[HOST:]PORT' into (host, port); the host defaults to localhost."""
+  host, _, port = address.rpartition(':')
+  return host or '127.0.0.1', int(port)
+
+
+class TidyWorkerHandler(socketserver.StreamRequestHandler):
+  """Checks one shard sent by a coordinator.
+
+  The request is a JSON line {"token", "cwd", "timeout", "tasks": [{"name",
+  "args", "fixes"}]}, where args is the clang-tidy command line without the
+  binary and -export-fixes. Each result is sent back as a JSON line {"name",
+  "stdout", "stderr", "fixes", "seconds"} as soon as it is done, followed by
+  {"done": true}. A request with the wrong token or a forbidden argument is
+  answered with {"error"} and not run.
+  """
+
+  def handle(self):
+    self.connection.settimeout(WORKER_REQUEST_TIMEOUT)
+    try:
+      shard = json.loads(self.rfile.readline().decode('utf-8'))
+    except (socket.error, ValueError):
+      return
+    self.connection.settimeout(None)
+    error = self.refuse(shard)
+    if error is not None:
+      sys.stderr.write('Refused shard from %s: %s\n' %
+                       (self.client_address[0], error))
+      try:
+        self.wfile.write(json.dumps({'error': error}).encode('utf-8') + b'\n')
+      except socket.error:
+        pass
+      return
+    if self.server.cache is not None:
+      self.server.cache.refresh()
+    tasks = queue.Queue()
+    for task in shard['tasks']:
+      tasks.put(task)
+    tmpdir = tempfile.mkdtemp()
+    send_lock = threading.Lock()
+
+    def work():
+      while True:
+        try:
+          task = tasks.get_nowait()
+        except queue.Empty:
+          return
+        message = self.check(task, shard['cwd'], shard.get('timeout'), tmpdir)
+        data = json.dumps(message).encode('utf-8') + b'\n'
+        try:
+          with send_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+        except socket.error:
+          return # The coordinator went away.
+
+    threads = [threading.Thread(target=work)
+               for _ in range(min(self.server.jobs, len(shard['tasks'])))]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    shutil.rmtree(tmpdir)
     try:
-      proc = subprocess.Popen(command,
-                              stdout=subprocess.PIPE,
-                              stderr=subprocess.PIPE)
+      self.wfile.write(b'{"done": true}\n')
+    except socket.error:
+      pass
+
+  def refuse(self, shard):
+    """Returns why shard must not be run, or None."""
+    if not isinstance(shard, dict):
+      return 'malformed request'
+    # Compared as JSON so that any type of token is refused, not raised on.
+    token = json.dumps(shard.get('token')).encode('utf-8')
+    if not hmac.compare_digest(token,
+                               json.dumps(self.server.token).encode('utf-8')):
+      return 'invalid worker token'
+    try:
+      for task in shard['tasks']:
+        arg = forbidden_worker_argument(task['args'])
+        if arg is not None:
+          return 'forbidden argument %s' % arg
+    except (KeyError, TypeError):
+      return 'malformed request'
+    return None
+
+  def check(self, task, cwd, timeout, tmpdir):
+    command = [self.server.clang_tidy_binary] + task['args']
+    fixes_file = None
+    if task['fixes']:
+      (handle, fixes_file) = tempfile.mkstemp(suffix='.yaml', dir=tmpdir)
+      os.close(handle)
+      command.insert(1, '-export-fixes=' + fixes_file)
+    # Results of -fix runs are the edited files, which the cache cannot
+    # replay.
+    cache = self.server.cache
+    if any(arg in ('-fix', '--fix', '-fix-errors', '--fix-errors')
+           for arg in task['args']):
+      cache = None
+    watchdog = None
+    try:
+      result, _, watchdog, seconds = check_file(
+          os.path.join(cwd, task['name']), command, fixes_file, timeout,
+          cache, cwd=cwd)
+    except Exception as e:
+      result, seconds = {'stdout': '', 'stderr': 'Failed: %s: %s' %
+                         (e, ' '.join(command)), 'fixes': None}, None
+    if watchdog is not None:
+      if not watchdog.is_alive():
+        result = dict(result, stderr=result['stderr'] +
+                      '\nTerminated by timeout: ' + ' '.join(command))
+        seconds = None
+      watchdog.cancel()
+    return dict(result, name=task['name'], seconds=seconds)
 
-      if timeout is not None:
-        watchdog = threading.Timer(timeout, proc.kill)
-        watchdog.start()
 
-      stdout, stderr = proc.communicate()
+def serve_worker(address, clang_tidy_binary, jobs, token, cache=None):
+  """Checks shards for -workers coordinators sending token until
+  interrupted."""
+  socketserver.ThreadingTCPServer.allow_reuse_address = True
+  server = socketserver.ThreadingTCPServer(parse_address(address),
+                                           TidyWorkerHandler)
+  server.daemon_threads = True
+  server.clang_tidy_binary = clang_tidy_binary
+  server.jobs = jobs
+  server.token = token
+  server.cache = cache
+  sys.stderr.write('Waiting for shards on %s:%d with %d jobs\n' %
+                   (server.server_address[0], server.server_address[1], jobs))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
 
+
+def run_shard(address, token, shard, tasks, timeout, lock, failed,
+              history=None, writer=None, merger=None):
+  """Sends a shard to a worker and reports its results as they arrive.
+
+  tasks maps each file to its (command, fixes_file). Files the worker did not
+  finish are added to failed, to be checked locally.
+  """
+  pending = dict((name, tasks[name]) for name in shard)
+  request = {'token': token, 'cwd': os.getcwd(), 'timeout': timeout,
+             'tasks': []}
+  for name in shard:
+    command, fixes_file = tasks[name]
+    request['tasks'].append({
+        'name': name,
+        'args': [arg for arg in command[1:] if fixes_file is None or
+                 arg != '-export-fixes=' + fixes_file],
+        'fixes': fixes_file is not None})
+  sock = None
+  try:
+    sock = socket.create_connection(parse_address(address))
+    sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+    for line in sock.makefile('rb'):
+      message = json.loads(line.decode('utf-8'))
+      if message.get('error'):
+        raise ValueError(message['error'])
+      if message.get('done'):
+        break
+      name = message['name']
+      command, fixes_file = pending.pop(name)
+      if message['fixes'] is not None:
+        with open(fixes_file, 'w') as f:
+          f.write(message['fixes'])
+      if history is not None and message['seconds'] is not None:
+        history.record(name, message['seconds'])
+      report_result(name, message, fixes_file, lock, writer, merger)
+  except (socket.error, ValueError, KeyError) as e:
+    with lock:
+      sys.stderr.write('Worker %s failed: %s\n' % (address, e))
+  finally:
+    if sock is not None:
+      sock.close()
+    if pending:
       with lock:
-        sys.stdout.write(stdout.decode('utf-8') + '\n')
-        sys.stdout.flush()
-        if stderr:
-          sys.stderr.write(stderr.decode('utf-8') + '\n')
-          sys.stderr.flush()
+        sys.stderr.write('Checking %d files of worker %s locally\n' %
+                         (len(pending), address))
+        failed.extend(name for name in shard if name in pending)
+
+
+DIAGNOSTIC_RE = re.compile(
+    r'^(.+?):(\d+):(\d+): (warning|error|note|remark|fatal error): '
+    r'(.*?)(?: \[([^ \]]+)\])?$')
+COLOR_RE = re.compile(r'\x1b\[[0-9;]*m')
+
+
+class DiagnosticParser(object):
+  """Turns clang-tidy output, fed line by line, into diagnostic records.
+
+  A diagnostic is complete once the next one starts, since the notes that
+  belong to it follow its header. Source excerpts and carets are skipped.
+  """
+
+  def __init__(self, translation_unit):
+    self.translation_unit = translation_unit
+    self.current = None
+
+  def feed(self, line):
+    match = DIAGNOSTIC_RE.match(COLOR_RE.sub('', line.rstrip('\r\n')))
+    if match is None:
+      return []
+    path, line, column, severity, message, check = match.groups()
+    location = {'file': path, 'line': int(line), 'column': int(column),
+                'message': message}
+    if severity == 'note':
+      if self.current is not None:
+        self.current['notes'].append(location)
+      return []
+    done = self.close()
+    location.update(severity=severity, check=check, notes=[],
+                    translation_unit=self.translation_unit)
+    self.current = location
+    return done
+
+  def close(self):
+    done = [self.current] if self.current is not None else []
+    self.current = None
+    return done
+
+
+class DiagnosticWriter(object):
+  """Writes diagnostics as JSON lines or as a streamed SARIF log."""
+
+  SARIF_SCHEMA = ('https://docs.oasis-open.org/sarif/sarif/v2.1.0/os/schemas/'
+                  'sarif-schema-2.1.0.json')
+  SARIF_LEVELS = {'warning': 'warning', 'error': 'error',
+                  'fatal error': 'error', 'remark': 'note'}
+
+  def __init__(self, output_format, stream):
+    self.format = output_format
+    self.stream = stream
+    self.lock = threading.Lock()
+    self.seen = set()
+    self.written = 0
+    self.duplicates = 0
+
+  def start(self):
+    if self.format == 'sarif':
+      self.stream.write('{"version": "2.1.0", "$schema": %s, "runs": [{"tool": '
+                        '{"driver": {"name": "clang-tidy", "informationUri": '
+                        '"https://clang.llvm.org/extra/clang-tidy/"}}, '
+                        '"results": [\n' % json.dumps(self.SARIF_SCHEMA))
+      self.stream.flush()
+
+  def _uri(self, path):
+    relative = os.path.relpath(os.path.abspath(path))
+    if not relative.startswith(os.pardir):
+      return relative.replace(os.sep, '/')
+    return 'file://' + os.path.abspath(path).replace(os.sep, '/')
+
+  def _location(self, diagnostic):
+    return {'physicalLocation': {
+        'artifactLocation': {'uri': self._uri(diagnostic['file'])},
+        'region': {'startLine': diagnostic['line'],
+                   'startColumn': diagnostic['column']}}}
+
+  def _sarif_result(self, diagnostic):
+    result = {'ruleId': diagnostic['check'] or 'clang-diagnostic',
+              'level': self.SARIF_LEVELS[diagnostic['severity']],
+              'message': {'text': diagnostic['message']},
+              'locations': [self._location(diagnostic)]}
+    if diagnostic['notes']:
+      result['relatedLocations'] = []
+      for note in diagnostic['notes']:
+        related = self._location(note)
+        related['message'] = {'text': note['message']}
+        result['relatedLocations'].append(related)
+    return result
+
+  def write(self, diagnostic):
+    # The same header diagnostic is reported by every file including it.
+    key = (os.path.abspath(diagnostic['file']), diagnostic['line'],
+           diagnostic['column'], diagnostic['check'], diagnostic['message'])
+    with self.lock:
+      if key in self.seen:
+        self.duplicates += 1
+        return
+      self.seen.add(key)
+      if self.format == 'sarif':
+        text = json.dumps(self._sarif_result(diagnostic))
+        if self.written:
+          text = ',\n' + text
+      else:
+        text = json.dumps(diagnostic) + '\n'
+      self.stream.write(text)
+      self.stream.flush()
+      self.written += 1
+
+  def write_output(self, translation_unit, stdout):
+    parser = DiagnosticParser(translation_unit)
+    for line in stdout.splitlines():
+      for diagnostic in parser.feed(line):
+        self.write(diagnostic)
+    for diagnostic in parser.close():
+      self.write(diagnostic)
+
+  def finish(self):
+    if self.format == 'sarif':
+      self.stream.write('\n]}]}\n')
+      self.stream.flush()
+    sys.stderr.write('%d diagnostics written, %d duplicates suppressed\n' %
+                     (self.written, self.duplicates))
+
+
+def run_clang_tidy_streaming(command, translation_unit, writer, timeout):
+  """Runs clang-tidy and writes its diagnostics while it is still running.
+
+  Returns (process, stdout, stderr, watchdog) like a communicate() call.
+  """
+  stderr_file = tempfile.TemporaryFile()
+  proc = subprocess.Popen(command,
+                          stdout=subprocess.PIPE,
+                          stderr=stderr_file)
+  watchdog = None
+  if timeout is not None:
+    watchdog = threading.Timer(timeout, proc.kill)
+    watchdog.start()
+
+  parser = DiagnosticParser(translation_unit)
+  lines = []
+  for line in iter(proc.stdout.readline, b''):
+    line = line.decode('utf-8', 'replace')
+    lines.append(line)
+    for diagnostic in parser.feed(line):
+      writer.write(diagnostic)
+  for diagnostic in parser.close():
+    writer.write(diagnostic)
+  proc.stdout.close()
+  proc.wait()
+
+  stderr_file.seek(0)
+  stderr = stderr_file.read().decode('utf-8', 'replace')
+  stderr_file.close()
+  return proc, ''.join(lines), stderr, watchdog
+
+
+def check_file(name, command, fixes_file, timeout, cache=None, writer=None,
+               cwd=None):
+  """Runs clang-tidy on one file, or replays its result from the cache.
+
+  Returns (result, streamed, watchdog, seconds), where seconds is None when
+  the result came from the cache. The caller cancels the watchdog.
+  """
+  watchdog = None
+  try:
+    key = None
+    result = None
+    if cache is not None:
+      # The temporary -export-fixes path differs on every run.
+      key = cache.key(name, [arg if fixes_file is None or
+                             not arg.endswith(fixes_file) else
+                             '-export-fixes' for arg in command], cwd)
+      result = cache.get(key)
+
+    streamed = False
+    seconds = None
+    if result is None:
+      start = time.time()
+      if writer is not None:
+        proc, stdout, stderr, watchdog = run_clang_tidy_streaming(
+            command, name, writer, timeout)
+        streamed = True
+      else:
+        proc = subprocess.Popen(command,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                cwd=cwd)
+
+        if timeout is not None:
+          watchdog = threading.Timer(timeout, proc.kill)
+          watchdog.start()
+
+        stdout, stderr = proc.communicate()
+        stdout = stdout.decode('utf-8')
+        stderr = stderr.decode('utf-8')
+      seconds = time.time() - start
+      result = {'stdout': stdout, 'stderr': stderr, 'fixes': None}
+      if fixes_file is not None and os.path.getsize(fixes_file):
+        with open(fixes_file) as f:
+          result['fixes'] = f.read()
+      # Killed or crashed runs are not cached.
+      if key is not None and proc.returncode in (0, 1):
+        cache.put(key, result)
+    elif result['fixes'] is not None:
+      with open(fixes_file, 'w') as f:
+        f.write(result['fixes'])
+    return result, streamed, watchdog, seconds
+  except Exception:
+    if watchdog is not None:
+      watchdog.cancel()
+    raise
+
+
+def report_result(name, result, fixes_file, lock, writer=None, merger=None,
+                  streamed=False):
+  """Hands a clang-tidy result to the fix merger and the output."""
+  if merger is not None and result['fixes'] is not None:
+    merger.add(fixes_file)
+
+  if writer is not None and not streamed:
+    writer.write_output(name, result['stdout'])
+
+  with lock:
+    if writer is None:
+      sys.stdout.write(result['stdout'] + '\n')
+      sys.stdout.flush()
+    if result['stderr']:
+      sys.stderr.write(result['stderr'] + '\n')
+      sys.stderr.flush()
+
+
+def run_tidy(task_queue, lock, timeout, cache=None, history=None,
+             writer=None, merger=None):
+  watchdog = None
+  while True:
+    name, command, fixes_file = task_queue.get()
+    try:
+      result, streamed, watchdog, seconds = check_file(
+          name, command, fixes_file, timeout, cache, writer)
+      timed_out = watchdog is not None and not watchdog.is_alive()
+      if history is not None and seconds is not None and not timed_out:
+        history.record(name, seconds)
+      report_result(name, result, fixes_file, lock, writer, merger, streamed)
     except Exception as e:
       with lock:
         sys.stderr.write('Failed: ' + str(e) + ': '.join(command) + '\n')
@@ -80,39 +1051,132 @@ def run_tidy(task_queue, lock, timeout):
               sys.stderr.write('Terminated by timeout: ' +
                                ' '.join(command) + '\n')
           watchdog.cancel()
+      watchdog = None
       task_queue.task_done()
 
 
-def start_workers(max_tasks, tidy_caller, task_queue, lock, timeout):
+def start_workers(max_tasks, tidy_caller, task_queue, lock, timeout,
+                  cache=None, history=None, writer=None, merger=None):
   for _ in range(max_tasks):
-    t = threading.Thread(target=tidy_caller, args=(task_queue, lock, timeout))
+    t = threading.Thread(target=tidy_caller,
+                         args=(task_queue, lock, timeout, cache, history,
+                               writer, merger))
     t.daemon = True
     t.start()
 
 
-def merge_replacement_files(tmpdir, mergefile):
-  """Merge all replacement files in a directory into a single file"""
+class ReplacementMerger(object):
+  """Merges exported fixes into one file while clang-tidy is still running.
+
+  Workers hand over each finished replacement file with add(). A background
+  thread parses it, drops diagnostics whose fix was already written in full
+  (shared headers are fixed once per including file), and appends the
+  remaining diagnostics to the output, so no complete list is ever kept in
+  memory. A fix is kept or dropped as a whole, and replacements are only
+  identical when their text matches too, so differing fixes for the same range
+  reach clang-apply-replacements, which reports the conflict.
+  """
+
   # The fixes suggested by clang-tidy >= 4.0.0 are given under
   # the top level key 'Diagnostics' in the output yaml files
   mergekey = "Diagnostics"
-  merged = []
-  for replacefile in glob.iglob(os.path.join(tmpdir, '*.yaml')):
-    content = yaml.safe_load(open(replacefile, 'r'))
+
+  def __init__(self, mergefile):
+    self.mergefile = mergefile
+    # The libyaml bindings are much faster when PyYAML was built with them.
+    self.loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    self.dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+    self.out = None
+    self.tmp_name = None
+    self.failed = False
+    self.written = 0
+    self.duplicates = 0
+    self.seen_diagnostics = set()
+    self.seen_replacements = set()
+    self.queue = queue.Queue()
+    self.thread = threading.Thread(target=self._run)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def add(self, replacefile):
+    self.queue.put(replacefile)
+
+  def _run(self):
+    while True:
+      replacefile = self.queue.get()
+      if replacefile is None:
+        return
+      try:
+        self.merge_file(replacefile)
+      except Exception:
+        self.failed = True
+        sys.stderr.write('Error merging fixes from %s\n' % replacefile)
+        traceback.print_exc()
+
+  def _is_new(self, diagnostic):
+    message = diagnostic.get('DiagnosticMessage', diagnostic)
+    key = (diagnostic.get('DiagnosticName'), message.get('Message'),
+           message.get('FilePath'), message.get('FileOffset'))
+    if key in self.seen_diagnostics:
+      return False
+    self.seen_diagnostics.add(key)
+
+    replacements = message.get('Replacements')
+    if not replacements:
+      return True
+    fix = set((r.get('FilePath'), r.get('Offset'), r.get('Length'),
+               r.get('ReplacementText')) for r in replacements)
+    if fix <= self.seen_replacements:
+      return False
+    self.seen_replacements |= fix
+    return True
+
+  def merge_file(self, replacefile):
+    with open(replacefile, 'r') as f:
+      content = yaml.load(f, Loader=self.loader)
     if not content:
-      continue # Skip empty files.
-    merged.extend(content.get(mergekey, []))
-
-  if merged:
-    # MainSourceFile: The key is required by the definition inside
-    # include/clang/Tooling/ReplacementsYaml.h, but the value
-    # is actually never used inside clang-apply-replacements,
-    # so we set it to '' here.
-    output = {'MainSourceFile': '', mergekey: merged}
-    with open(mergefile, 'w') as out:
-      yaml.safe_dump(output, out)
-  else:
-    # Empty the file:
-    open(mergefile, 'w').close()
+      return # Skip empty files.
+    diagnostics = content.get(self.mergekey) or []
+    merged = [d for d in diagnostics if self._is_new(d)]
+    self.duplicates += len(diagnostics) - len(merged)
+    if not merged:
+      return
+
+    if self.out is None:
+      (handle, self.tmp_name) = tempfile.mkstemp(
+          dir=os.path.dirname(os.path.abspath(self.mergefile)))
+      self.out = os.fdopen(handle, 'w')
+      # MainSourceFile: The key is required by the definition inside
+      # include/clang/Tooling/ReplacementsYaml.h, but the value
+      # is actually never used inside clang-apply-replacements,
+      # so we set it to '' here.
+      self.out.write("MainSourceFile: ''\n%s:\n" % self.mergekey)
+    # A block sequence at the key's own indentation is valid YAML, so each
+    # batch can be appended as a top-level list.
+    yaml.dump(merged, self.out, Dumper=self.dumper, default_flow_style=False)
+    self.written += len(merged)
+
+  def finish(self):
+    """Waits for pending files and moves the merged file into place."""
+    self.queue.put(None)
+    self.thread.join()
+    if self.out is not None:
+      self.out.close()
+      os.rename(self.tmp_name, self.mergefile)
+    else:
+      # Empty the file:
+      open(self.mergefile, 'w').close()
+    if self.failed:
+      raise RuntimeError('some replacement files could not be merged')
+    return self.written, self.duplicates
+
+
+def merge_replacement_files(tmpdir, mergefile):
+  """Merge all replacement files in a directory into a single file"""
+  merger = ReplacementMerger(mergefile)
+  for replacefile in glob.iglob(os.path.join(tmpdir, '*.yaml')):
+    merger.add(replacefile)
+  return merger.finish()
 
 
 def main():
@@ -163,6 +1227,35 @@ def main():
   parser.add_argument('-load', dest='plugins',
                       action='append', default=[],
                       help='Load the specified plugin in clang-tidy.')
+  parser.add_argument('-cache-dir', metavar='DIR', dest='cache_dir',
+                      help='Reuse clang-tidy results stored in DIR for files '
+                      'whose inputs have not changed (ignored with -fix).')
+  parser.add_argument('-cache-max-size', metavar='MB', dest='cache_max_size',
+                      type=int, default=512,
+                      help='Evict least recently used cache entries past '
+                      'this size.')
+  parser.add_argument('-format', '--format', dest='output_format',
+                      choices=['text', 'jsonl', 'sarif'], default='text',
+                      help='Output format: clang-tidy text, one JSON object '
+                      'per diagnostic, or a SARIF 2.1.0 log.')
+  parser.add_argument('-timing-history', metavar='FILE', dest='timing_history',
+                      help='Record per-file runtimes in FILE and start the '
+                      'slowest files first (default: DIR/timings.json with '
+                      '-cache-dir, otherwise files are ordered by size).')
+  parser.add_argument('-workers', metavar='HOST:PORT[,HOST:PORT...]',
+                      help='Split the files into one shard per worker, '
+                      'grouped by precompiled header in the compile '
+                      'database, and check them on clang-tidy-diff.py '
+                      'workers started with -serve.')
+  parser.add_argument('-serve', metavar='[HOST:]PORT',
+                      help='Run as a worker for -workers coordinators with -j '
+                      'clang-tidy instances instead of reading a diff '
+                      '(listens on localhost unless a host is given).')
+  parser.add_argument('-worker-token', metavar='TOKEN', dest='worker_token',
+                      default=os.environ.get('CLANG_TIDY_DIFF_WORKER_TOKEN'),
+                      help='Shared secret -workers coordinators send and '
+                      '-serve workers require (default: '
+                      '$CLANG_TIDY_DIFF_WORKER_TOKEN).')
 
   clang_tidy_args = []
   argv = sys.argv[1:]
@@ -172,36 +1265,39 @@ def main():
 
   args = parser.parse_args(argv)
 
+  if (args.serve or args.workers) and not args.worker_token:
+    parser.error('-serve and -workers need -worker-token or '
+                 '$CLANG_TIDY_DIFF_WORKER_TOKEN')
+  if args.workers and args.fix:
+    parser.error('-fix cannot be used with -workers')
+
+  if args.serve:
+    cache = None
+    if args.cache_dir:
+      cache = ResultCache(args.cache_dir, args.clang_tidy_binary,
+                          args.build_path, args.cache_max_size * 1048576)
+    serve_worker(args.serve, args.clang_tidy_binary,
+                 args.j or multiprocessing.cpu_count(), args.worker_token,
+                 cache)
+    if cache is not None:
+      cache.report(cache.evict())
+    return
+
   # Extract changed lines for each file.
-  filename = None
-  lines_by_file = {}
-  for line in sys.stdin:
-    match = re.search('^\+\+\+\ \"?(.*?/){%s}([^ \t\n\"]*)' % args.p, line)
-    if match:
-      filename = match.group(2)
-    if filename is None:
-      continue
-
-    if args.regex is not None:
-      if not re.match('^%s$' % args.regex, filename):
-        continue
-    else:
-      if not re.match('^%s$' % args.iregex, filename, re.IGNORECASE):
-        continue
+  lines_by_file = clang_diff_parser.parse_diff(
+      getattr(sys.stdin, 'buffer', sys.stdin), args.p, args.regex, args.iregex)
 
-    match = re.search('^@@.*\+(\d+)(,(\d+))?', line)
-    if match:
-      start_line = int(match.group(1))
-      line_count = 1
-      if match.group(3):
-        line_count = int(match.group(3))
-      if line_count == 0:
-        continue
-      end_line = start_line + line_count - 1
-      lines_by_file.setdefault(filename, []).append([start_line, end_line])
+  writer = None
+  if args.output_format != 'text':
+    writer = DiagnosticWriter(args.output_format, sys.stdout)
 
   if not any(lines_by_file):
-    print("No relevant changes found.")
+    if writer is not None:
+      sys.stderr.write("No relevant changes found.\n")
+      writer.start()
+      writer.finish()
+    else:
+      print("No relevant changes found.")
     sys.exit(0)
 
   max_task_count = args.j
@@ -210,16 +1306,42 @@ def main():
   max_task_count = min(len(lines_by_file), max_task_count)
 
   tmpdir = None
+  merger = None
   if yaml and args.export_fixes:
     tmpdir = tempfile.mkdtemp()
+    merger = ReplacementMerger(args.export_fixes)
 
   # Tasks for clang-tidy.
   task_queue = queue.Queue(max_task_count)
   # A lock for console output.
   lock = threading.Lock()
 
-  # Run a pool of clang-tidy workers.
-  start_workers(max_task_count, run_tidy, task_queue, lock, args.timeout)
+  # Results of -fix runs are the edited files, which the cache cannot replay.
+  cache = None
+  if args.cache_dir and not args.fix:
+    try:
+      cache = ResultCache(args.cache_dir, args.clang_tidy_binary,
+                          args.build_path, args.cache_max_size * 1048576)
+    except (OSError, subprocess.CalledProcessError) as e:
+      sys.stderr.write('Result cache disabled: %s\n' % e)
+
+  # Start the most expensive files first so that one large translation unit
+  # does not end up running alone at the end.
+  history_path = args.timing_history
+  if history_path is None and args.cache_dir:
+    if not os.path.isdir(args.cache_dir):
+      os.makedirs(args.cache_dir)
+    history_path = os.path.join(args.cache_dir, 'timings.json')
+  history = RuntimeHistory(history_path)
+  costs, unit = history.estimate(lines_by_file)
+  order, (makespan, longest) = schedule_longest_first(costs, max_task_count)
+  if unit == 'seconds' and not args.workers:
+    sys.stderr.write('Expected critical path: %.1fs on %d workers '
+                     '(longest file %s, %.1fs)\n' %
+                     (makespan, max_task_count, longest, costs[longest]))
+
+  if writer is not None:
+    writer.start()
 
   # Form the common args list.
   common_clang_tidy_args = []
@@ -240,7 +1362,8 @@ def main():
   for plugin in args.plugins:
     common_clang_tidy_args.append('-load=%s' % plugin)
 
-  for name in lines_by_file:
+  tasks = {}
+  for name in order:
     line_filter_json = json.dumps(
       [{"name": name, "lines": lines_by_file[name]}],
       separators=(',', ':'))
@@ -248,6 +1371,7 @@ def main():
     # Run clang-tidy on files containing changes.
     command = [args.clang_tidy_binary]
     command.append('-line-filter=' + line_filter_json)
+    tmp_name = None
     if yaml and args.export_fixes:
       # Get a temporary file. We immediately close the handle so clang-tidy can
       # overwrite it.
@@ -258,15 +1382,55 @@ def main():
     command.append(name)
     command.extend(clang_tidy_args)
 
-    task_queue.put(command)
+    tasks[name] = (command, tmp_name)
+
+  local = order
+  if args.workers:
+    addresses = args.workers.split(',')
+    shards = shard_by_compile_database(order, costs, args.build_path,
+                                       len(addresses))
+    # Files of unreachable or failing workers are checked here instead.
+    local = []
+    threads = []
+    for address, shard in zip(addresses, shards):
+      if not shard:
+        continue
+      t = threading.Thread(target=run_shard,
+                           args=(address, args.worker_token, shard, tasks,
+                                 args.timeout, lock, local, history, writer,
+                                 merger))
+      t.start()
+      threads.append(t)
+    for t in threads:
+      t.join()
+
+  if local:
+    # Run a pool of clang-tidy workers.
+    start_workers(min(max_task_count, len(local)), run_tidy, task_queue, lock,
+                  args.timeout, cache, history, writer, merger)
+    for name in local:
+      command, tmp_name = tasks[name]
+      task_queue.put((name, command, tmp_name))
+
+    # Wait for all threads to be done.
+    task_queue.join()
+
+  if writer is not None:
+    writer.finish()
 
-  # Wait for all threads to be done.
-  task_queue.join()
+  history.save()
+  if cache is not None:
+    cache.report(cache.evict())
 
   if yaml and args.export_fixes:
-    print('Writing fixes to ' + args.export_fixes + ' ...')
+    # Structured output owns stdout.
+    (sys.stdout if writer is None else sys.stderr).write(
+        'Writing fixes to ' + args.export_fixes + ' ...\n')
     try:
-      merge_replacement_files(tmpdir, args.export_fixes)
+      # Most files were merged while the workers were running.
+      written, duplicates = merger.finish()
+      if duplicates:
+        sys.stderr.write('%d duplicate fixes dropped\n' % duplicates)
     except:
       sys.stderr.write('Error exporting fixes.\n')
       traceback.print_exc()
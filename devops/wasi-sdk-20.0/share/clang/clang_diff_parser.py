@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+#
+#===- clang_diff_parser.py - Unified diff parsing for the diff tools -------===#
+#
+# Part of the LLVM Project, under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+#
+#===------------------------------------------------------------------------===#
+
+"""
+Extracts the changed line ranges of each file from a unified diff. Shared by
+clang-tidy-diff.py and clang-format-diff.py.
+
+The input is read as bytes in large blocks and scanned with one precompiled
+pattern that only stops at '+++' and '@@' lines, so the content lines that make
+up most of a diff are skipped without creating a Python object for each. The
+file filter is evaluated once per file, and overlapping or adjacent ranges are
+merged.
+
+Run directly to compare against line-by-line parsing:
+
+  python clang_diff_parser.py [-p1] [big.diff]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import re
+import sys
+import time
+
+# Bytes read per block; each block is cut at its last newline.
+BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def _diff_pattern(strip):
+  return re.compile(
+      br'^(?:\+\+\+ "?(?:[^\n]*?/){%d}([^ \t\r\n"]*)'
+      br'|@@ [^\n]*?\+(\d+)(?:,(\d+))?)' % int(strip),
+      re.MULTILINE)
+
+
+def _decode(name):
+  if hasattr(os, 'fsdecode'):
+    return os.fsdecode(name)
+  return name
+
+
+def _merge_ranges(ranges):
+  """Sorts [start, end] ranges and joins those that overlap or touch."""
+  merged = []
+  for start, end in sorted(ranges):
+    if merged and start <= merged[-1][1] + 1:
+      merged[-1][1] = max(merged[-1][1], end)
+    else:
+      merged.append([start, end])
+  return merged
+
+
+def parse_diff(stream, strip=0, regex=None, iregex=None,
+               keep_empty_hunks=False, merge=True):
+  """Returns {filename: [[start_line, end_line], ...]} for a unified diff.
+
+  stream must be a binary file object. strip removes the smallest prefix
+  containing that many slashes from the file names. A file is kept when its
+  name matches regex, or iregex case insensitively when regex is None.
+  Hunks that add no lines are dropped unless keep_empty_hunks is set, in which
+  case they cover the line where they would start.
+  """
+  pattern = _diff_pattern(strip)
+  if regex is not None:
+    name_filter = re.compile('^%s$' % regex)
+  elif iregex is not None:
+    name_filter = re.compile('^%s$' % iregex, re.IGNORECASE)
+  else:
+    name_filter = None
+
+  lines_by_file = {}
+  order = []
+  selected = {}
+  ranges = None
+  leftover = b''
+  while True:
+    block = stream.read(BLOCK_SIZE)
+    data = leftover + block
+    if not data:
+      break
+    if block:
+      cut = data.rfind(b'\n') + 1
+      data, leftover = data[:cut], data[cut:]
+    else:
+      leftover = b''
+
+    for name, start, count in pattern.findall(data):
+      if name or not start:
+        filename = _decode(name)
+        if filename not in selected:
+          selected[filename] = (name_filter is None or
+                                name_filter.match(filename) is not None)
+        ranges = None
+        if selected[filename]:
+          if filename not in lines_by_file:
+            lines_by_file[filename] = []
+            order.append(filename)
+          ranges = lines_by_file[filename]
+        continue
+      if ranges is None:
+        continue
+
+      start_line = int(start)
+      line_count = int(count) if count else 1
+      if line_count == 0:
+        if not keep_empty_hunks:
+          continue
+        line_count = 1
+      ranges.append([start_line, start_line + line_count - 1])
+
+    if not block:
+      break
+
+  result = {}
+  for filename in order:
+    if lines_by_file[filename]:
+      result[filename] = (_merge_ranges(lines_by_file[filename]) if merge
+                          else lines_by_file[filename])
+  return result
+
+
+def _parse_line_by_line(stream, strip, regex, iregex):
+  """The per-line parser the diff scripts used before, kept for comparison."""
+  filename = None
+  lines_by_file = {}
+  for line in stream:
+    match = re.search(r'^\+\+\+\ \"?(.*?/){%s}([^ \t\n\"]*)' % strip, line)
+    if match:
+      filename = match.group(2)
+    if filename is None:
+      continue
+
+    if regex is not None:
+      if not re.match('^%s$' % regex, filename):
+        continue
+    else:
+      if not re.match('^%s$' % iregex, filename, re.IGNORECASE):
+        continue
+
+    match = re.search(r'^@@.*\+(\d+)(,(\d+))?', line)
+    if match:
+      start_line = int(match.group(1))
+      line_count = 1
+      if match.group(3):
+        line_count = int(match.group(3))
+      if line_count == 0:
+        continue
+      end_line = start_line + line_count - 1
+      lines_by_file.setdefault(filename, []).append([start_line, end_line])
+  return lines_by_file
+
+
+def _synthetic_diff(files, hunks, lines):
+  parts = []
+  for f in range(files):
+    name = 'src/module%d/file%d.%s' % (f % 50, f, 'cpp' if f % 4 else 'txt')
+    parts.append('diff --git a/%s b/%s\n--- a/%s\n+++ b/%s\n' %
+                 (name, name, name, name))
+    for h in range(hunks):
+      start = 1 + h * (lines + 3)
+      parts.append('@@ -%d,%d +%d,%d @@ void f%d()\n' %
+                   (start, lines, start, lines, h))
+      for i in range(lines):
+        parts.append('+  int value%d = compute(%d) + offset;\n' % (i, i))
+  return ''.join(parts).encode('utf-8')
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark the diff parser.')
+  parser.add_argument('diff', nargs='?',
+                      help='diff to parse (default: a generated one)')
+  parser.add_argument('-p', metavar='NUM', default=1,
+                      help='strip the smallest prefix containing P slashes')
+  parser.add_argument('-iregex', metavar='PATTERN', default=
+                      r'.*\.(cpp|cc|c\+\+|cxx|c|cl|h|hpp|m|mm|inc)')
+  args = parser.parse_args()
+
+  if args.diff:
+    with open(args.diff, 'rb') as f:
+      data = f.read()
+  else:
+    data = _synthetic_diff(files=2000, hunks=20, lines=40)
+  print('%.1f MB of diff' % (len(data) / 1048576.0))
+
+  import io
+  start = time.time()
+  text = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8',
+                          errors='replace')
+  old = _parse_line_by_line(text, args.p, None, args.iregex)
+  old_time = time.time() - start
+
+  start = time.time()
+  new = parse_diff(io.BytesIO(data), args.p, None, args.iregex, merge=False)
+  new_time = time.time() - start
+
+  start = time.time()
+  merged = parse_diff(io.BytesIO(data), args.p, None, args.iregex)
+  merged_time = time.time() - start
+
+  print('line by line: %6.2fs  %d files' % (old_time, len(old)))
+  print('block scan:   %6.2fs  %d files (%.1fx)' %
+        (new_time, len(new), old_time / max(new_time, 1e-9)))
+  print('  + merging:  %6.2fs  %d ranges -> %d' %
+        (merged_time, sum(len(r) for r in new.values()),
+         sum(len(r) for r in merged.values())))
+  if old != new:
+    print('results differ from the line-by-line parser')
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
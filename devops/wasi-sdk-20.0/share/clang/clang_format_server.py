@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+#
+#===- clang_format_server.py - Persistent clang-format broker --------------===#
+#
+# Part of the LLVM Project, under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+#
+#===------------------------------------------------------------------------===#
+
+"""
+A small local broker that the editor integrations (clang-format.py and
+clang-format-sublime.py) send their format requests to, instead of starting
+clang-format themselves on every key press.
+
+One broker runs per workspace and clang-format binary, listening on a Unix
+socket in a directory only the user can access: $XDG_RUNTIME_DIR, or a
+'clang-format-server-<uid>' directory in the temporary directory. The first
+request starts it, and it exits on its own after being idle for a while. The
+broker:
+
+- resolves the '.clang-format' or '_clang-format' file of each directory once
+  and passes it as '-style=file:<path>', so clang-format does not search the
+  directory tree again; an entry is re-checked when the modification time of
+  the file, or of a parent file it inherits from, changes or after STYLE_TTL
+  seconds;
+- keeps the most recent results, so pressing the key again on an unchanged
+  buffer does not run clang-format at all;
+- serves requests on several threads, so editors sharing a workspace do not
+  wait for each other.
+
+clang-format has no library or resident mode, so a request that misses the
+result cache still runs one clang-format process, started by the broker.
+
+Each request is one JSON header line followed by the buffer:
+
+  {"args": [...], "cwd": "...", "length": <bytes of input>}\\n<input>
+
+and each reply one JSON header line followed by stdout and stderr:
+
+  {"returncode": 0, "stdout": <bytes>, "stderr": <bytes>}\\n<stdout><stderr>
+
+Clients call format_buffer(), which falls back to running clang-format
+directly when the broker cannot be reached. Run directly to serve or stop a
+broker:
+
+  python clang_format_server.py [-binary clang-format] [-workspace DIR]
+  python clang_format_server.py -stop [-workspace DIR]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import collections
+import errno
+import hashlib
+import json
+import os
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+  import socketserver
+except ImportError:
+  import SocketServer as socketserver
+
+# Seconds without a request before the broker exits.
+IDLE_TIMEOUT = 15 * 60
+
+# Seconds a resolved style file is trusted before its directory is searched
+# again, so a newly created, closer '.clang-format' is picked up.
+STYLE_TTL = 5.0
+
+# Number of recent results kept by the broker.
+RESULT_CACHE_SIZE = 64
+
+# Seconds a client waits for a newly started broker to listen.
+START_TIMEOUT = 2.0
+
+STYLE_FILES = ('.clang-format', '_clang-format')
+
+
+def _private_directory(path):
+  """Returns True if path is a real directory that only the user can access."""
+  try:
+    st = os.lstat(path)
+  except OSError:
+    return False
+  return (stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and
+          not st.st_mode & 0o077)
+
+
+def socket_directory():
+  """Returns the directory holding the user's broker sockets.
+
+  Raises OSError if the directory in the temporary directory exists but is
+  not a private directory of the user, e.g. one created by someone else.
+  """
+  runtime = os.environ.get('XDG_RUNTIME_DIR')
+  if runtime and _private_directory(runtime):
+    return runtime
+  path = os.path.join(tempfile.gettempdir(),
+                      'clang-format-server-%d' % os.getuid())
+  try:
+    os.mkdir(path, 0o700)
+  except OSError as e:
+    if e.errno != errno.EEXIST:
+      raise
+  if not _private_directory(path):
+    raise OSError(errno.EPERM, 'not a private directory', path)
+  return path
+
+
+def socket_path(workspace, binary):
+  """Returns the socket path of the broker for workspace and binary."""
+  key = '%s\0%s' % (os.path.abspath(workspace), binary)
+  digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+  return os.path.join(socket_directory(),
+                      'clang-format-server-%s.sock' % digest)
+
+
+def _read_exact(stream, length):
+  data = stream.read(length)
+  if len(data) != length:
+    raise EOFError('connection closed after %d of %d bytes' %
+                   (len(data), length))
+  return data
+
+
+class StyleCache(object):
+  """Maps source directories to the style file clang-format would use."""
+
+  def __init__(self, ttl=STYLE_TTL):
+    self.ttl = ttl
+    self.lock = threading.Lock()
+    self.entries = {}
+
+  def _find(self, directory):
+    while True:
+      for name in STYLE_FILES:
+        path = os.path.join(directory, name)
+        try:
+          return path, os.stat(path).st_mtime
+        except OSError:
+          pass
+      parent = os.path.dirname(directory)
+      if parent == directory:
+        return None, None
+      directory = parent
+
+  def _chain(self, directory):
+    """Returns [(path, mtime)] of the style file for directory followed by
+    the parent files it inherits from with InheritParentConfig."""
+    chain = []
+    while True:
+      path, mtime = self._find(directory)
+      if path is None:
+        return chain
+      chain.append((path, mtime))
+      try:
+        with open(path, 'rb') as f:
+          if b'InheritParentConfig' not in f.read():
+            return chain
+      except (IOError, OSError):
+        return chain
+      parent = os.path.dirname(os.path.dirname(path))
+      if parent == os.path.dirname(path):
+        return chain
+      directory = parent
+
+  def lookup(self, directory):
+    """Returns (path, mtimes) of the style file for directory. path is None
+    if there is none or it inherits from a parent configuration; mtimes
+    covers every file of the inheritance chain."""
+    now = time.time()
+    with self.lock:
+      entry = self.entries.get(directory)
+    if entry is not None:
+      chain, checked = entry
+      if now - checked < self.ttl:
+        try:
+          if all(os.stat(path).st_mtime == mtime for path, mtime in chain):
+            return self._result(chain)
+        except OSError:
+          pass
+    chain = self._chain(directory)
+    with self.lock:
+      self.entries[directory] = (chain, now)
+    return self._result(chain)
+
+  @staticmethod
+  def _result(chain):
+    # An inherited style is left to clang-format, which walks the chain.
+    path = chain[0][0] if len(chain) == 1 else None
+    return path, [mtime for _, mtime in chain]
+
+
+def _assumed_filename(args):
+  for i, arg in enumerate(args):
+    if arg == '-assume-filename' and i + 1 < len(args):
+      return args[i + 1]
+    if arg.startswith('-assume-filename='):
+      return arg.split('=', 1)[1]
+  return None
+
+
+def _has_explicit_style(args):
+  for i, arg in enumerate(args):
+    if arg == '-style' and i + 1 < len(args):
+      return args[i + 1] != 'file'
+    if arg.startswith('-style='):
+      return arg != '-style=file'
+  return False
+
+
+def _without_style(args):
+  result = []
+  skip = False
+  for arg in args:
+    if skip:
+      skip = False
+    elif arg == '-style':
+      skip = True
+    elif not arg.startswith('-style='):
+      result.append(arg)
+  return result
+
+
+class FormatServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+
+  def __init__(self, path, binary, idle_timeout=IDLE_TIMEOUT):
+    socketserver.UnixStreamServer.__init__(self, path, FormatHandler)
+    self.binary = binary
+    self.idle_timeout = idle_timeout
+    self.styles = StyleCache()
+    self.results = collections.OrderedDict()
+    self.results_lock = threading.Lock()
+    self.last_request = time.time()
+
+  def server_bind(self):
+    # Create the socket without group or other permissions, rather than
+    # narrowing them after it already accepts connections.
+    umask = os.umask(0o177)
+    try:
+      socketserver.UnixStreamServer.server_bind(self)
+    finally:
+      os.umask(umask)
+
+  def format(self, args, cwd, data):
+    """Runs clang-format with args on data and returns
+    (returncode, stdout, stderr)."""
+    self.last_request = time.time()
+    filename = _assumed_filename(args)
+    mtimes = None
+    if filename and not _has_explicit_style(args):
+      directory = os.path.dirname(os.path.join(cwd or '', filename))
+      style, mtimes = self.styles.lookup(os.path.abspath(directory))
+      if style is not None:
+        args = _without_style(args) + ['-style=file:%s' % style]
+    # The mtimes of the style file and the files it inherits from are part of
+    # the key, so editing any of them invalidates earlier results.
+    key = hashlib.sha1(json.dumps([args, cwd, mtimes]).encode('utf-8') +
+                       b'\0' + data).digest()
+    with self.results_lock:
+      result = self.results.get(key)
+      if result is not None:
+        self.results[key] = self.results.pop(key)
+        return result
+    p = subprocess.Popen([self.binary] + args, cwd=cwd or None,
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate(data)
+    result = (p.returncode, stdout, stderr)
+    if p.returncode == 0:
+      with self.results_lock:
+        self.results[key] = result
+        while len(self.results) > RESULT_CACHE_SIZE:
+          self.results.popitem(last=False)
+    return result
+
+  def watch_idle(self):
+    while True:
+      time.sleep(min(self.idle_timeout, 30))
+      if time.time() - self.last_request >= self.idle_timeout:
+        self.shutdown()
+        return
+
+
+class FormatHandler(socketserver.StreamRequestHandler):
+
+  def handle(self):
+    while True:
+      line = self.rfile.readline()
+      if not line:
+        return
+      header = json.loads(line.decode('utf-8'))
+      if header.get('stop'):
+        self.wfile.write(b'{}\n')
+        self.wfile.flush()
+        threading.Thread(target=self.server.shutdown).start()
+        return
+      data = _read_exact(self.rfile, header['length'])
+      try:
+        returncode, stdout, stderr = self.server.format(
+            header['args'], header.get('cwd'), data)
+      except OSError as e:
+        returncode, stdout, stderr = 1, b'', str(e).encode('utf-8')
+      reply = {'returncode': returncode, 'stdout': len(stdout),
+               'stderr': len(stderr)}
+      self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+      self.wfile.write(stdout)
+      self.wfile.write(stderr)
+      self.wfile.flush()
+
+
+def serve(binary, workspace, idle_timeout=IDLE_TIMEOUT):
+  path = socket_path(workspace, binary)
+  if os.path.lexists(path):
+    # Never take over a live broker of the user. Anything else, a stale
+    # socket or one that is not the user's, is replaced.
+    try:
+      _connect(path).close()
+      return
+    except (socket.error, OSError):
+      os.unlink(path)
+  server = FormatServer(path, binary, idle_timeout)
+  watcher = threading.Thread(target=server.watch_idle)
+  watcher.daemon = True
+  watcher.start()
+  try:
+    server.serve_forever()
+  finally:
+    server.server_close()
+    try:
+      os.unlink(path)
+    except OSError:
+      pass
+
+
+def _connect(path):
+  """Connects to the broker socket at path if it belongs to the user."""
+  st = os.lstat(path)
+  if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+    raise socket.error(errno.EPERM, 'not a socket of the user', path)
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(path)
+  except socket.error:
+    sock.close()
+    raise
+  return sock
+
+
+def _start(binary, workspace, python):
+  kwargs = {}
+  if sys.version_info[0] >= 3:
+    # Unlike preexec_fn, safe in the editor's multithreaded process.
+    kwargs['start_new_session'] = True
+  elif hasattr(os, 'setsid'):
+    kwargs['preexec_fn'] = os.setsid
+  with open(os.devnull, 'r+b') as devnull:
+    subprocess.Popen([python, os.path.abspath(__file__), '-binary', binary,
+                      '-workspace', workspace], stdin=devnull, stdout=devnull,
+                     stderr=devnull, close_fds=True, **kwargs)
+
+
+def _default_python():
+  # Inside vim, sys.executable can be vim itself.
+  name = os.path.basename(sys.executable or '')
+  if name.startswith('python'):
+    return sys.executable
+  return 'python3'
+
+
+def _request(sock, args, cwd, data):
+  header = {'args': args, 'cwd': cwd, 'length': len(data)}
+  sock.sendall(json.dumps(header).encode('utf-8') + b'\n' + data)
+  stream = sock.makefile('rb')
+  try:
+    reply = json.loads(stream.readline().decode('utf-8'))
+    stdout = _read_exact(stream, reply['stdout'])
+    stderr = _read_exact(stream, reply['stderr'])
+  finally:
+    stream.close()
+  return reply['returncode'], stdout, stderr
+
+
+def _run_directly(binary, args, cwd, data, startupinfo):
+  p = subprocess.Popen([binary] + args, cwd=cwd,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                       stdin=subprocess.PIPE, startupinfo=startupinfo)
+  stdout, stderr = p.communicate(input=data)
+  return p.returncode, stdout, stderr
+
+
+def format_buffer(binary, args, data, workspace=None, cwd=None,
+                  python=None, startupinfo=None):
+  """Formats data with 'binary args' and returns (returncode, stdout, stderr).
+
+  The request goes to the broker of workspace (default: cwd), which is started
+  if it is not running. Without Unix sockets, or when the broker cannot be
+  reached, clang-format is run directly.
+  """
+  cwd = cwd or os.getcwd()
+  if not hasattr(socket, 'AF_UNIX') or not hasattr(os, 'getuid'):
+    return _run_directly(binary, args, cwd, data, startupinfo)
+  try:
+    path = socket_path(workspace or cwd, binary)
+  except OSError:
+    return _run_directly(binary, args, cwd, data, startupinfo)
+  try:
+    sock = _connect(path)
+  except (socket.error, OSError):
+    try:
+      _start(binary, workspace or cwd, python or _default_python())
+    except OSError:
+      return _run_directly(binary, args, cwd, data, startupinfo)
+    deadline = time.time() + START_TIMEOUT
+    sock = None
+    while sock is None and time.time() < deadline:
+      time.sleep(0.02)
+      try:
+        sock = _connect(path)
+      except (socket.error, OSError):
+        pass
+    if sock is None:
+      return _run_directly(binary, args, cwd, data, startupinfo)
+  try:
+    return _request(sock, args, cwd, data)
+  except (socket.error, EOFError, ValueError, KeyError):
+    return _run_directly(binary, args, cwd, data, startupinfo)
+  finally:
+    sock.close()
+
+
+def stop(binary, workspace):
+  """Asks the broker of workspace to exit; returns False if none runs."""
+  try:
+    sock = _connect(socket_path(workspace, binary))
+  except (socket.error, OSError):
+    return False
+  try:
+    sock.sendall(b'{"stop": true}\n')
+    sock.recv(16)
+  except socket.error:
+    # Already shutting down.
+    pass
+  finally:
+    sock.close()
+  return True
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1],
+                                   formatter_class=
+                                   argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('-binary', default='clang-format',
+                      help='location of binary to use for clang-format')
+  parser.add_argument('-workspace', default=os.getcwd(),
+                      help='workspace the broker serves (default: cwd)')
+  parser.add_argument('-idle-timeout', type=float, default=IDLE_TIMEOUT,
+                      help='seconds without requests before exiting '
+                      '(default: %(default)s)')
+  parser.add_argument('-stop', action='store_true',
+                      help='stop the running broker and exit')
+  args = parser.parse_args()
+  if args.stop:
+    sys.exit(0 if stop(args.binary, args.workspace) else 1)
+  serve(args.binary, args.workspace, args.idle_timeout)
+
+
+if __name__ == '__main__':
+  main()